@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+ bench_negotiation
+ ~~~~~~~~~~~~~~~~~
+ The per request cost of selecting the API format from the Accept and
+ User-Agent headers, with and without the memo of ``get_format``. Every
+ measured request is a new request object, as in production.
+
+    python benchmarks/bench_negotiation.py -n 10000 -o out.json
+
+ :copyright: 2026 by the rdreilib team, see doc/AUTHORS for more details.
+ :license: BSD, see doc/LICENSE for more details.
+"""
+from optparse import OptionParser
+
+from werkzeug import Request, EnvironBuilder
+
+from benchutils import measure, write_report
+from rdreilib import api
+
+
+CLIENTS = {
+    'service': {'Accept': 'application/json',
+                'User-Agent': 'python-requests/0.6.1'},
+    'firefox': {'Accept': 'text/html,application/xhtml+xml,'
+                          'application/xml;q=0.9,*/*;q=0.8',
+                'User-Agent': 'Mozilla/5.0 (X11; U; Linux x86_64; en-US; '
+                              'rv:1.9.1.5) Gecko/20091109 Firefox/3.5.5'},
+    'chrome': {'Accept': 'application/xml,application/xhtml+xml,'
+                         'text/html;q=0.9,text/plain;q=0.8,*/*;q=0.5',
+               'User-Agent': 'Mozilla/5.0 (X11; U; Linux x86_64; en-US) '
+                             'AppleWebKit/532.5 (KHTML, like Gecko) '
+                             'Chrome/4.0.249.30 Safari/532.5'},
+}
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--requests', type='int', default=10000,
+                      help='requests per measurement')
+    parser.add_option('-r', '--repeat', type='int', default=10)
+    parser.add_option('-o', '--output', help='write JSON here, not stdout')
+    options, args = parser.parse_args()
+
+    results = []
+    for client, headers in sorted(CLIENTS.items()):
+        environ = EnvironBuilder(path='/api/', headers=headers).get_environ()
+        def run(select):
+            for i in xrange(options.requests):
+                select(Request(environ.copy()))
+        for name, select in [('uncached', api.negotiate_format),
+                             ('memoized', api.get_format)]:
+            timings = measure(lambda: run(select), options.repeat)
+            for key in ('min_ms', 'median_ms', 'max_ms'):
+                timings[key.replace('_ms', '_us_per_request')] = \
+                    timings[key] * 1000 / options.requests
+            timings.update(name='negotiation.%s.%s' % (client, name),
+                           requests=options.requests)
+            results.append(timings)
+    write_report(results, options.output)
+
+
+if __name__ == '__main__':
+    main()
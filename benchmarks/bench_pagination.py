@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+ bench_pagination
+ ~~~~~~~~~~~~~~~~
+ Benchmarks for the pagination hot path: ``page()`` on plain lists and on
+ SQLite-backed SQLAlchemy queries, first versus deep pages, the cost of the
+ count and of building the Digg page ranges.
+
+ Results are written as JSON, so runs of different releases can be
+ compared::
+
+    python benchmarks/bench_pagination.py --sizes 10000,1000000 -o out.json
+
+ :copyright: 2026 by the rdreilib team, see doc/AUTHORS for more details.
+ :license: BSD, see doc/LICENSE for more details.
+"""
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+from optparse import OptionParser
+
+import sqlalchemy
+from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
+
+from benchutils import measure, write_report
+from rdreilib.pagination import Paginator, DiggPaginator, KeysetPaginator, \
+     encode_cursor, exact_count
+
+
+Base = declarative_base()
+
+class Entry(Base):
+    __tablename__ = 'entries'
+    id = Column(Integer, primary_key=True)
+    score = Column(Integer, index=True)
+    title = Column(String(40))
+
+
+def rows(page):
+    """Forces the rows of a page to be fetched."""
+    return list(page.object_list)
+
+
+def populate(session, size, chunk=50000):
+    """Inserts ``size`` rows with executemany in chunks."""
+    table = Entry.__table__
+    for bottom in xrange(0, size, chunk):
+        session.execute(table.insert(), [
+            {'id': i, 'score': i % 1000, 'title': 'Entry %d' % i}
+            for i in xrange(bottom + 1, min(size, bottom + chunk) + 1)])
+    session.commit()
+
+
+def bench_list(size, per_page, repeat):
+    items = range(size)
+    last = Paginator(items, per_page).num_pages
+    yield 'list.page.first', measure(
+        lambda: rows(Paginator(items, per_page).page(1)), repeat)
+    yield 'list.page.deep', measure(
+        lambda: rows(Paginator(items, per_page).page(last)), repeat)
+    yield 'list.count', measure(
+        lambda: exact_count(items), repeat)
+    yield 'list.digg.first', measure(
+        lambda: rows(DiggPaginator(items, per_page).page(1)), repeat)
+    yield 'list.digg.middle', measure(
+        lambda: rows(DiggPaginator(items, per_page).page(last // 2)), repeat)
+
+    # Range building alone: the count is known, the slice is cheap.
+    paginator = DiggPaginator(items, per_page)
+    paginator.count
+    yield 'digg.ranges', measure(
+        lambda: paginator.page(last // 2), repeat)
+
+
+def bench_query(session, size, per_page, repeat):
+    query = session.query(Entry).order_by(Entry.id)
+    last = Paginator(query, per_page).num_pages
+    yield 'query.page.first', measure(
+        lambda: rows(Paginator(query, per_page).page(1)), repeat)
+    yield 'query.page.deep', measure(
+        lambda: rows(Paginator(query, per_page).page(last)), repeat)
+    yield 'query.count', measure(
+        lambda: exact_count(query), repeat)
+    yield 'query.page.first.countless', measure(
+        lambda: rows(DiggPaginator(query, per_page, align_left=True,
+                                   countless=True).page(1)), repeat)
+    yield 'query.page.deep.countless', measure(
+        lambda: rows(DiggPaginator(query, per_page, align_left=True,
+                                   countless=True).page(last)), repeat)
+
+    # The keyset equivalent of the deep page above.
+    keyset = KeysetPaginator(query, per_page, (Entry.id,))
+    cursor = encode_cursor(((last - 1) * per_page,))
+    yield 'query.keyset.first', measure(lambda: rows(keyset.page()), repeat)
+    yield 'query.keyset.deep', measure(
+        lambda: rows(keyset.page(cursor)), repeat)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--sizes', default='10000,100000,1000000',
+                      help='comma separated row counts, up to 10000000')
+    parser.add_option('-p', '--per-page', type='int', default=20)
+    parser.add_option('-r', '--repeat', type='int', default=20)
+    parser.add_option('--no-query', action='store_true', default=False,
+                      help='skip the SQLite benchmarks')
+    parser.add_option('-o', '--output', help='write JSON here, not stdout')
+    options, args = parser.parse_args()
+
+    results = []
+    tmpdir = tempfile.mkdtemp(prefix='bench_pagination')
+    try:
+        for size in map(int, options.sizes.split(',')):
+            benchmarks = list(bench_list(size, options.per_page,
+                                         options.repeat))
+            if not options.no_query:
+                engine = create_engine('sqlite:///%s' % os.path.join(
+                    tmpdir, '%d.db' % size))
+                Base.metadata.create_all(engine)
+                session = sessionmaker(bind=engine)()
+                populate(session, size)
+                benchmarks.extend(bench_query(session, size,
+                                              options.per_page,
+                                              options.repeat))
+                session.close()
+                engine.dispose()
+            for name, timings in benchmarks:
+                timings.update(name=name, size=size,
+                               per_page=options.per_page)
+                results.append(timings)
+                print >> sys.stderr, '%-30s %10d %10.3f ms' % (
+                    name, size, timings['median_ms'])
+    finally:
+        shutil.rmtree(tmpdir)
+
+    write_report(results, options.output,
+                 sqlalchemy=sqlalchemy.__version__,
+                 sqlite=sqlite3.sqlite_version)
+
+
+if __name__ == '__main__':
+    main()
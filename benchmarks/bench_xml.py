@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+ bench_xml
+ ~~~~~~~~~
+ Compares the single pass XML serializer of ``rdreilib.api`` with the
+ nested implementation it replaced, on wide and on deep result trees.
+
+    python benchmarks/bench_xml.py --sizes 100,10000 -o out.json
+
+ :copyright: 2026 by the rdreilib team, see doc/AUTHORS for more details.
+ :license: BSD, see doc/LICENSE for more details.
+"""
+from optparse import OptionParser
+from xml.sax.saxutils import quoteattr
+
+from werkzeug import escape
+
+from benchutils import measure, write_report
+from rdreilib import api
+
+
+def nested_dump_xml(obj):
+    """The former ``dump_xml``, joining every subtree into its parent."""
+    def _dump(obj):
+        if isinstance(obj, dict):
+            d = dict(obj)
+            obj_type = d.pop('#type', None)
+            key = start = 'dict'
+            if obj_type is not None:
+                if obj_type.startswith('solace.'):
+                    key = start = obj_type[7:]
+                else:
+                    start += ' type=%s' % quoteattr(obj_type)
+            return u'<%s>%s</%s>' % (
+                start,
+                u''.join((u'<%s>%s</%s>' % (key, _dump(value), key)
+                         for key, value in d.iteritems())),
+                key
+            )
+        if isinstance(obj, (tuple, list)):
+            def _item_dump(obj):
+                if not isinstance(obj, (tuple, list, dict)):
+                    return u'<item>%s</item>' % _dump(obj)
+                return _dump(obj)
+            return u'<list>%s</list>' % (u''.join(map(_item_dump, obj)))
+        if isinstance(obj, bool):
+            return obj and u'yes' or u'no'
+        return escape(unicode(obj))
+    return (
+        u'<?xml version="1.0" encoding="utf-8"?>'
+        u'<result xmlns="%s">%s</result>'
+    ) % (api.XML_NS, _dump(obj))
+
+
+def wide_tree(size):
+    """A list endpoint: ``size`` flat user records."""
+    return [{'#type': 'solace.user', 'id': i, 'username': u'user%d' % i,
+             'is_admin': i % 50 == 0,
+             'joined': {'#type': 'solace.datetime',
+                        'value': '2009-05-01T12:00:00Z'}}
+            for i in xrange(size)]
+
+
+def deep_tree(depth):
+    """``depth`` levels of nested dicts and lists."""
+    tree = {'leaf': u'<value & more>'}
+    for i in xrange(depth):
+        tree = {'#type': 'node', 'children': [tree, i], 'level': i}
+    return tree
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--sizes', default='100,1000,10000,100000',
+                      help='comma separated record counts')
+    parser.add_option('-d', '--depths', default='10,50,150',
+                      help='comma separated nesting depths')
+    parser.add_option('-r', '--repeat', type='int', default=10)
+    parser.add_option('-o', '--output', help='write JSON here, not stdout')
+    options, args = parser.parse_args()
+
+    cases = [('wide', size, wide_tree(size))
+             for size in map(int, options.sizes.split(','))]
+    cases.extend(('deep', depth, deep_tree(depth))
+                 for depth in map(int, options.depths.split(',')))
+
+    results = []
+    for shape, size, tree in cases:
+        assert nested_dump_xml(tree) == api.dump_xml(tree)
+        for name, func in [('nested', nested_dump_xml),
+                           ('single_pass', api.dump_xml),
+                           ('streamed', lambda tree: sum(
+                               map(len, api.iter_dump_xml_encoded(tree))))]:
+            timings = measure(lambda: func(tree), options.repeat)
+            timings.update(name='xml.%s.%s' % (shape, name), size=size)
+            results.append(timings)
+    write_report(results, options.output)
+
+
+if __name__ == '__main__':
+    main()
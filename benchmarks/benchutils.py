@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+ benchutils
+ ~~~~~~~~~~
+ Timing and reporting helpers shared by the benchmarks.
+
+
+ :copyright: 2026 by the rdreilib team, see doc/AUTHORS for more details.
+ :license: BSD, see doc/LICENSE for more details.
+"""
+import os
+import sys
+import platform
+from datetime import datetime
+from timeit import default_timer
+
+import simplejson
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def measure(func, repeat):
+    """Calls ``func`` ``repeat`` times and returns the timings in ms."""
+    timings = []
+    for i in xrange(repeat):
+        start = default_timer()
+        func()
+        timings.append((default_timer() - start) * 1000.0)
+    timings.sort()
+    return {
+        'repeat':       repeat,
+        'min_ms':       timings[0],
+        'median_ms':    timings[len(timings) // 2],
+        'max_ms':       timings[-1],
+    }
+
+
+def write_report(results, output=None, **meta):
+    """Writes the results as JSON to the file ``output`` or stdout.
+    Additional keyword arguments end up in the ``meta`` section."""
+    meta.update(
+        date=datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        python=platform.python_version(),
+        platform=platform.platform(),
+    )
+    report = {'meta': meta, 'results': results}
+    if output:
+        f = open(output, 'w')
+        try:
+            simplejson.dump(report, f, indent=2)
+        finally:
+            f.close()
+    else:
+        simplejson.dump(report, sys.stdout, indent=2)
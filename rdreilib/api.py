@@ -10,26 +10,47 @@
 """
 import re
 import os
+import time
 import inspect
 import logging
+import zlib
+import hashlib
+import errno
+import stat
 import simplejson
 import suds.client
 from xml.sax.saxutils import quoteattr
+from xml.etree import cElementTree as etree
 from suds import WebFault
+from suds.cache import ObjectCache
 from urllib2 import URLError
 from functools import update_wrapper
+from itertools import chain
+from weakref import WeakKeyDictionary
+from threading import Lock, local as thread_local
+from multiprocessing.pool import ThreadPool
 from babel import Locale, UnknownLocaleError
-from werkzeug.exceptions import MethodNotAllowed, BadRequest
-from werkzeug import Response, escape, Request
+from werkzeug.exceptions import MethodNotAllowed, BadRequest, HTTPException
+from werkzeug import Response, escape, Request, generate_etag
 
-from glashammer.utils.local import get_app
+from glashammer.utils.local import get_app, local, local_manager
 from glashammer.utils.wrappers import render_template
-from glashammer.utils.lazystring import make_lazy_string
+from glashammer.utils.lazystring import make_lazy_string, is_lazy_string
 
 from glashammer.bundles.i18n2 import _, has_section
-from .remoting import remote_export_primitive
+from .remoting import remote_export_primitive, RemoteObject
+from .msgpacklib import dump_msgpack, MSGPACK_MIMETYPE
+from .serializers import dump_json, register_serializer, serializers, \
+     stream_serializers, serializer_mimetypes, raw_serializers, \
+     on_serializers_changed
+from .utils import LRUCache
+from .metrics import record_call, metrics_snapshot
 from .rst_formatting import format_rst
 from .decorators import on_method
+from .circuitbreaker import CircuitBreaker, CircuitOpenError, \
+     get_circuit_breaker, circuit_breaker_status
+from .soap_transport import KeepAliveTransport, get_call_timeout, \
+     set_call_timeout
 
 
 # If this is included too early, eager loading raises a KeyError.
@@ -47,54 +68,215 @@ def debug_dump(obj):
     return render_template('api/debug_dump.html', dump=dump)
 
 
+def _buffered(iterable, size=8192):
+    """Joins the small strings of ``iterable`` into chunks of about
+    ``size`` bytes."""
+    buf = []
+    length = 0
+    for item in iterable:
+        buf.append(item)
+        length += len(item)
+        if length >= size:
+            yield ''.join(buf)
+            buf = []
+            length = 0
+    if buf:
+        yield ''.join(buf)
+
+
+def _iter_json(obj):
+    if isinstance(obj, RemoteObject):
+        obj = obj.remote_export()
+    # lazy strings are iterable proxies, they must not be taken for lists
+    if is_lazy_string(obj) or isinstance(obj, Locale):
+        yield dump_json(remote_export_primitive(obj))
+    elif isinstance(obj, dict):
+        yield '{'
+        first = True
+        for key, value in obj.iteritems():
+            if not first:
+                yield ','
+            first = False
+            if key is None or isinstance(key, bool):
+                key = dump_json(key)
+            elif not isinstance(key, basestring):
+                key = unicode(key)
+            yield dump_json(key)
+            yield ':'
+            for chunk in _iter_json(value):
+                yield chunk
+        yield '}'
+    elif hasattr(obj, '__iter__'):
+        yield '['
+        first = True
+        for item in obj:
+            if not first:
+                yield ','
+            first = False
+            for chunk in _iter_json(item):
+                yield chunk
+        yield ']'
+    else:
+        yield dump_json(remote_export_primitive(obj))
+
+
+def iter_dump_json(obj):
+    """Yields the JSON for the API result ``obj`` in chunks. Unlike
+    :func:`remote_export_primitive` followed by ``dumps``, objects are
+    exported one by one while encoding, so iterators and queries are never
+    held in memory as a whole."""
+    return _buffered(_iter_json(obj))
+
+
+def _is_container(obj):
+    return isinstance(obj, (tuple, list, dict)) or hasattr(obj, '__iter__')
+
+
+#: Leaves that are written as they are, no export needed.
+_plain_types = frozenset([unicode, str, int, long, float, type(None)])
+_container_types = frozenset([dict, list, tuple])
+
+
+def _xml_leaf(obj):
+    """Exports a leaf and returns its text, or returns the exported
+    container for remote objects and datetimes."""
+    if obj.__class__ not in _plain_types:
+        obj = remote_export_primitive(obj)
+        if _is_container(obj):
+            return obj
+    if isinstance(obj, bool):
+        return obj and u'yes' or u'no'
+    return escape(unicode(obj))
+
+
+def _expand_xml(obj, write):
+    """Writes the fragments of one dict or list. Nested containers are
+    yielded instead of being expanded recursively, the closing tags are
+    written once the caller resumes the generator."""
+    if isinstance(obj, dict):
+        obj_type = obj.get('#type')
+        tag = start = u'dict'
+        if obj_type is not None:
+            if obj_type.startswith('solace.'):
+                tag = start = obj_type[7:]
+            else:
+                start += u' type=%s' % quoteattr(obj_type)
+        write(u'<%s>' % start)
+        for key, value in obj.iteritems():
+            if key == '#type':
+                continue
+            if value.__class__ in _plain_types:
+                write(u'<%s>%s</%s>' % (key, escape(unicode(value)), key))
+                continue
+            if value.__class__ not in _container_types:
+                value = _xml_leaf(value)
+                if isinstance(value, unicode):
+                    write(u'<%s>%s</%s>' % (key, value, key))
+                    continue
+            write(u'<%s>' % key)
+            yield value
+            write(u'</%s>' % key)
+        write(u'</%s>' % tag)
+    else:
+        write(u'<list>')
+        for item in obj:
+            if item.__class__ in _plain_types:
+                write(u'<item>%s</item>' % escape(unicode(item)))
+                continue
+            if item.__class__ not in _container_types:
+                item = _xml_leaf(item)
+                if isinstance(item, unicode):
+                    write(u'<item>%s</item>' % item)
+                    continue
+            yield item
+        write(u'</list>')
+
+
+def _iter_xml(obj, size=4096):
+    """Yields the XML of ``obj`` in chunks of about ``size`` fragments."""
+    if not _is_container(obj):
+        obj = _xml_leaf(obj)
+        if isinstance(obj, unicode):
+            yield obj
+            return
+    # An explicit stack instead of recursion: every fragment is written
+    # once, however deep the tree is.
+    out = []
+    write = out.append
+    stack = [_expand_xml(obj, write)]
+    while stack:
+        for child in stack[-1]:
+            stack.append(_expand_xml(child, write))
+            break
+        else:
+            stack.pop()
+        if len(out) >= size:
+            yield u''.join(out)
+            del out[:]
+    yield u''.join(out)
+
+
+_XML_HEADER = u'<?xml version="1.0" encoding="utf-8"?><result xmlns="%s">'
+
+
+def iter_dump_xml(obj):
+    """Yields the simple XML format of :func:`dump_xml` in fragments, in a
+    single pass over ``obj``. This works on the raw API result as well,
+    remote objects are exported as they are reached."""
+    yield _XML_HEADER % XML_NS
+    for chunk in _iter_xml(obj):
+        yield chunk
+    yield u'</result>'
+
+
+def iter_dump_xml_encoded(obj):
+    """Same as :func:`iter_dump_xml` but yields utf-8 encoded chunks of
+    about 8 KB, ready to be used as WSGI iterable."""
+    return _buffered(chunk.encode('utf-8') for chunk in iter_dump_xml(obj))
+
+
 def dump_xml(obj):
     """Dumps data into a simple XML format."""
-    def _dump(obj):
-        if isinstance(obj, dict):
-            d = dict(obj)
-            obj_type = d.pop('#type', None)
-            key = start = 'dict'
-            if obj_type is not None:
-                if obj_type.startswith('solace.'):
-                    key = start = obj_type[7:]
-                else:
-                    start += ' type=%s' % quoteattr(obj_type)
-            return u'<%s>%s</%s>' % (
-                start,
-                u''.join((u'<%s>%s</%s>' % (key, _dump(value), key)
-                         for key, value in d.iteritems())),
-                key
-            )
-        if isinstance(obj, (tuple, list)):
-            def _item_dump(obj):
-                if not isinstance(obj, (tuple, list, dict)):
-                    return u'<item>%s</item>' % _dump(obj)
-                return _dump(obj)
-            return u'<list>%s</list>' % (u''.join(map(_item_dump, obj)))
-        if isinstance(obj, bool):
-            return obj and u'yes' or u'no'
-        return escape(unicode(obj))
-    return (
-        u'<?xml version="1.0" encoding="utf-8"?>'
-        u'<result xmlns="%s">%s</result>'
-    ) % (XML_NS, _dump(obj))
+    return u'%s%s</result>' % (_XML_HEADER % XML_NS, u''.join(_iter_xml(obj)))
 
 
 def get_serializer(request):
     """Returns the serializer for the given API request."""
+    return _serializer_map[get_format(request)]
+
+
+#: Formats negotiated for (Accept, User-Agent) header pairs
+_negotiated_formats = LRUCache(256)
+
+
+def get_format(request):
+    """Returns the name of the format for the given API request."""
     format = request.args.get('format')
     if format is not None:
-        rv = _serializer_map.get(format)
-        if rv is None:
+        if format not in _serializer_map:
             raise BadRequest(_(u'Unknown format "%s"') % escape(format))
-        return rv
+        return format
 
+    # The raw headers decide the format, so the parsing of the user agent
+    # and of the accept header are only needed for new header values.
+    key = (request.environ.get('HTTP_ACCEPT'),
+           request.environ.get('HTTP_USER_AGENT'))
+    format = _negotiated_formats.get(key)
+    if format is None:
+        format = negotiate_format(request)
+        _negotiated_formats.put(key, format)
+    return format
+
+
+def negotiate_format(request):
+    """Selects the format from the accept header and the user agent of the
+    request, see :func:`get_format`."""
     # webkit sends useless accept headers. They accept XML over
     # HTML or have no preference at all. We spotted them, so they
     # are obviously not regular API users, just ignore the accept
     # header and return the debug serializer.
     if request.user_agent.browser in ('chrome', 'safari'):
-        return _serializer_map['debug']
+        return 'debug'
 
     best_match = (None, 0)
     for mimetype, serializer in _serializer_for_mimetypes.iteritems():
@@ -111,9 +293,9 @@ def get_serializer(request):
     # text/html is the same as the best match, we prefer HTML.
     if best_match[0] != 'text/html' and \
        best_match[1] == request.accept_mimetypes['text/html']:
-        return _serializer_map['debug']
+        return 'debug'
 
-    return _serializer_map[best_match[0]]
+    return best_match[0]
 
 
 def prepare_api_request(request):
@@ -136,19 +318,149 @@ def prepare_api_request(request):
         request.view_lang = locale
 
 
-def send_api_response(request, result):
-    """Sends the API response."""
+def get_content_encoding(request):
+    """Returns the compression to use for the response, gzip or deflate,
+    or None if the client accepts neither or compression is disabled."""
+    if not get_app().cfg['api/compress_level']:
+        return None
+    return request.accept_encodings.best_match(('gzip', 'deflate'))
+
+
+def _compress_chunks(chunks, encoding, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                  _compressor_wbits[encoding])
+    for chunk in chunks:
+        # sync flushes send every chunk on to the client right away
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response, encoding):
+    """Compresses ``response`` with ``encoding`` unless its body is smaller
+    than the ``api/compress_min_size`` config value. Streamed bodies are
+    compressed chunk by chunk, only their first chunks are read up front
+    to compare them to the threshold."""
+    cfg = get_app().cfg
+    min_size = cfg['api/compress_min_size']
+    level = cfg['api/compress_level']
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        chunks = iter(response.response)
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= min_size:
+                break
+        else:
+            response.response = head
+            return
+        response.response = _compress_chunks(chain(head, chunks),
+                                             encoding, level)
+    else:
+        data = response.data
+        if len(data) < min_size:
+            return
+        response.data = ''.join(_compress_chunks((data,), encoding, level))
+    response.headers['Content-Encoding'] = encoding
+
+
+def version_etag(request, version):
+    """Returns the ETag of the API response for ``version`` of a resource.
+    The format, the requested language and the compression are part of
+    the tag, as they change the response as well."""
+    return generate_etag('%s|%s|%s|%s' % (
+        version, get_format(request),
+        request.headers.get('Accept-Language', ''),
+        get_content_encoding(request)))
+
+
+def send_api_response(request, result, stream=False, etag=None,
+                      figures=None):
+    """Sends the API response. If ``stream`` is True and the format can be
+    streamed, the result is exported and serialized while the response is
+    sent, instead of as a whole up front.
+
+    ``etag`` is either the ETag of the response or True to use a hash of
+    the serialized body, which is not available for streamed responses.
+    Requests with a matching `If-None-Match` header get a 304 response.
+
+    The response is compressed if the client accepts gzip or deflate, see
+    :func:`compress_response`. If ``figures`` is a dict, the export and
+    serialization times are stored in it in milliseconds.
+    """
     status = 200
     if type(result) is dict and 'error' in result:
         status = 500
 
-    ro = remote_export_primitive(result)
-    serializer, mimetype = get_serializer(request)
-    return Response(serializer(ro), mimetype=mimetype, status=status)
+    format = get_format(request)
+    serializer, mimetype = _serializer_map[format]
+    if stream and format in _stream_serializer_map:
+        response = Response(_stream_serializer_map[format](result),
+                            mimetype=mimetype, status=status,
+                            direct_passthrough=True)
+    else:
+        start = time.time()
+        if format not in raw_serializers:
+            result = remote_export_primitive(result)
+        exported = time.time()
+        response = Response(serializer(result), mimetype=mimetype,
+                            status=status)
+        if figures is not None:
+            figures['export'] = (exported - start) * 1000
+            figures['serialize'] = (time.time() - exported) * 1000
+
+    encoding = get_content_encoding(request)
+    if encoding is not None:
+        compress_response(response, encoding)
+    if etag is True and not response.is_streamed:
+        etag = generate_etag(response.data)
+
+    if etag and etag is not True and status == 200:
+        response.set_etag(etag)
+        response.make_conditional(request)
+    return response
 
 
-def api_method(methods=('GET',)):
-    """Helper decorator for API methods."""
+def _measured_stream(chunks, handler, figures, start):
+    """Passes ``chunks`` on and records the call once they are sent. The
+    export and serialization of streamed results are measured together."""
+    size = 0
+    serialize = 0
+    try:
+        chunks = iter(chunks)
+        while 1:
+            chunk_start = time.time()
+            try:
+                chunk = chunks.next()
+            except StopIteration:
+                break
+            serialize += time.time() - chunk_start
+            size += len(chunk)
+            yield chunk
+    finally:
+        figures.update(serialize=serialize * 1000, bytes=size,
+                       total=(time.time() - start) * 1000)
+        record_call(handler, figures)
+
+
+#: Set while a batch call runs, see :func:`_run_batch_call`
+_batch_state = thread_local()
+
+
+def api_method(methods=('GET',), stream=False, etag=False, version=None):
+    """Helper decorator for API methods. Set ``stream`` for methods
+    returning large lists, see :func:`send_api_response`.
+
+    With ``etag`` set, responses are tagged with a hash of their body, so
+    clients can revalidate them. ``version`` is called with the arguments
+    of the view and returns the current version of the resource instead,
+    e.g. a modification timestamp. If the client's copy is current, the
+    view is not called at all.
+    """
     def decorator(f):
         def wrapper(self, *args, **kwargs):
             # Check whether self is an request object or the bound instance
@@ -156,43 +468,249 @@ def api_method(methods=('GET',)):
                 request = self
             else:
                 request = args[0]
+            # Read on every call, as soap_api_method and SOAPActionFactory
+            # rename the wrapper after decorating it.
+            handler = wrapper.__name__
+            if handler.startswith('api_'):
+                handler = handler[4:]
 
-            if request.method not in methods:
+            capture = getattr(_batch_state, 'capture', False)
+            if capture:
+                # Only the outermost API method of a batch call is captured
+                _batch_state.capture = False
+            elif request.method not in methods:
                 raise MethodNotAllowed(methods)
+            start = time.time()
             prepare_api_request(request)
+            if capture:
+                _batch_state.result = f(self, *args, **kwargs)
+                return Response(status=204)
+            tag = etag
+            if version is not None:
+                tag = version_etag(request, version(self, *args, **kwargs))
+                if tag in request.if_none_match:
+                    response = Response(status=304)
+                    response.set_etag(tag)
+                    record_call(handler, {
+                        'total': (time.time() - start) * 1000, 'bytes': 0})
+                    return response
+            view_start = time.time()
             rv = f(self, *args, **kwargs)
-            return send_api_response(request, rv)
+            figures = {'view': (time.time() - view_start) * 1000}
+            response = send_api_response(request, rv, stream, tag, figures)
+            if response.is_streamed:
+                response.response = _measured_stream(response.response,
+                                                     handler, figures, start)
+            else:
+                figures['bytes'] = response.status_code != 304 and \
+                    len(response.data) or 0
+                figures['total'] = (time.time() - start) * 1000
+                record_call(handler, figures)
+            return response
         f.is_api_method = True
         f.valid_methods = tuple(methods)
+        # The undecorated view, to check the arguments of batch calls
+        wrapper._api_func = f
         return update_wrapper(wrapper, f)
     return decorator
 
-def soap_api_method(methods=('GET',)):
+_thread_pools = {}
+_thread_pools_lock = Lock()
+
+
+def _get_thread_pool(name, size):
+    """Returns the thread pool ``name``. Separate pools for batches and
+    SOAP calls keep batch calls from waiting on their own SOAP calls."""
+    pool = _thread_pools.get(name)
+    if pool is None:
+        _thread_pools_lock.acquire()
+        try:
+            pool = _thread_pools.get(name)
+            if pool is None:
+                pool = _thread_pools[name] = ThreadPool(size)
+        finally:
+            _thread_pools_lock.release()
+    return pool
+
+
+#: Maximum number of calls in one batch
+BATCH_MAX_CALLS = 20
+#: Number of threads running the calls of parallel batches
+BATCH_POOL_SIZE = 4
+
+
+_missing = object()
+
+
+def _run_batch_call(request, endpoint, args):
+    """Runs one call of a batch and returns its result entry. The view is
+    called with all its decorators, so their permission checks apply, and
+    :func:`api_method` hands over the result instead of sending it."""
+    try:
+        view = get_app().view_finder.find(endpoint)
+    except Exception:
+        view = None
+    if not getattr(view, 'is_api_method', False):
+        return {'status': 404, 'result': {
+            'error': u'Unknown API method "%s"' % endpoint}}
+    if view._api_func is api_batch._api_func:
+        # Nested batches multiply the calls and could block the pool.
+        return {'status': 400, 'result': {
+            'error': u'Batches can not be nested'}}
+    bound = getattr(view, 'im_self', None)
+    try:
+        inspect.getcallargs(view._api_func,
+                            *(bound is not None and (bound, request) or
+                              (request,)), **args)
+    except TypeError, e:
+        return {'status': 400, 'result': {'error': unicode(e)}}
+
+    _batch_state.capture = True
+    _batch_state.result = _missing
+    try:
+        response = view(request, **args)
+        result = _batch_state.result
+    except HTTPException, e:
+        return {'status': e.code, 'result': {'error': e.description}}
+    except Exception:
+        log.exception('Batch call of %s failed' % endpoint)
+        return {'status': 500, 'result': {'error': u'Internal error'}}
+    finally:
+        _batch_state.capture = False
+        _batch_state.result = None
+    if result is _missing:
+        # A decorator answered in place of the view, e.g. a failed check
+        return {'status': getattr(response, 'status_code', 500),
+                'result': {'error': getattr(response, 'status',
+                                            u'Internal error')}}
+    status = 200
+    if type(result) is dict and 'error' in result:
+        status = 500
+    return {'status': status, 'result': remote_export_primitive(result)}
+
+
+def _run_batch_call_in_worker(context, request, endpoint, args):
+    # The views expect the application and request of the batch in the
+    # context locals of their thread.
+    local.application, local.request, local.url_adapter = context
+    try:
+        return _run_batch_call(request, endpoint, args)
+    finally:
+        local_manager.cleanup()
+        try:
+            from glashammer.bundles.sqlalchdb import session
+        except ImportError:
+            pass
+        else:
+            session.remove()
+
+
+@api_method(methods=('POST',))
+def api_batch(request):
+    """Runs several API methods in one request. The body is a JSON list of
+    ``[endpoint, args]`` pairs, args being the URL values of the method::
+
+        [["api/get_user", {"username": "bert"}], ["api/badges", {}]]
+
+    The response is a list with one ``{"status": ..., "result": ...}`` entry
+    per call, in the format negotiated for the batch. The calls go through
+    all decorators of their views, like requests of their own. With the
+    ``parallel`` URL argument set the calls run concurrently on worker
+    threads, each with a database session of its own, so they must not
+    depend on each other.
+    """
+    try:
+        calls = simplejson.loads(request.data)
+        calls = [(unicode(endpoint), dict((str(key), value)
+                                          for key, value in args.iteritems()))
+                 for endpoint, args in calls]
+    except (ValueError, TypeError, AttributeError):
+        raise BadRequest(_(u'Expected a list of [endpoint, args] pairs'))
+    if len(calls) > BATCH_MAX_CALLS:
+        raise BadRequest(_(u'Too many calls, the limit is %d') %
+                         BATCH_MAX_CALLS)
+
+    if request.args.get('parallel') and len(calls) > 1:
+        pool = _get_thread_pool('batch', BATCH_POOL_SIZE)
+        context = (local.application, local.request,
+                   getattr(local, 'url_adapter', None))
+        pending = [pool.apply_async(_run_batch_call_in_worker,
+                                    (context, request, endpoint, args))
+                   for endpoint, args in calls]
+        return [result.get() for result in pending]
+    return [_run_batch_call(request, endpoint, args)
+            for endpoint, args in calls]
+
+
+def soap_api_method(methods=('GET',), breaker=None, breaker_options=None):
     """Helper decorator for SOAP API methods that use suds. Tries to prepare
     results and catches WebFaults. Also invokes the :func:``api_method``
-    decorator."""
+    decorator.
+
+    Calls go through a circuit breaker, named after the function unless
+    ``breaker`` gives a name or a :class:`CircuitBreaker`. While it is open
+    the method returns an error right away. ``breaker_options`` are passed
+    to new breakers, False as ``breaker`` disables it."""
     def decorator(f):
+        if breaker is False or isinstance(breaker, CircuitBreaker):
+            circuit = breaker or None
+        else:
+            circuit = get_circuit_breaker(
+                breaker or '%s.%s' % (f.__module__, f.__name__),
+                **(breaker_options or {}))
+
         @api_method(methods)
         def wrapper(request, *args, **kwargs):
+            if circuit is not None and not circuit.allow():
+                return {'error': 'Service unavailable: %s' % circuit.name}
+            start = time.time()
+            success = False
             try:
                 result = f(request, *args, **kwargs)
-            except (WebFault,URLError) as exc:
+                success = True
+            except (WebFault, URLError, CircuitOpenError) as exc:
                 # TODO: Look out how other REST services handle errors!
                 log.error('SOAP request failed: %r' % exc)
                 return {'error': str(exc)}
+            finally:
+                if circuit is not None:
+                    circuit.record(success, time.time() - start)
 
             return result
 
         return update_wrapper(wrapper, f)
     return decorator
 
-def list_api_methods():
-    """List all API methods."""
+
+@api_method()
+def api_metrics(request):
+    """Returns the latency and size histograms of the API handlers of this
+    process."""
+    return metrics_snapshot()
+
+
+@api_method()
+def api_circuit_breakers(request):
+    """Returns the state of the circuit breakers of the SOAP methods."""
+    return circuit_breaker_status()
+
+
+#: application -> (routes, index) of :func:`list_api_methods`
+_api_indexes = WeakKeyDictionary()
+#: docstring -> HTML, the docs are rendered once per process
+_rendered_docs = {}
+
+
+def _render_doc(doc):
+    rv = _rendered_docs.get(doc)
+    if rv is None:
+        rv = _rendered_docs[doc] = format_rst(doc.decode('utf-8'))
+    return rv
+
+
+def _build_api_index(application, rules):
     result = []
-    application = get_app()
-    for rule in application.map.iter_rules():
-        if rule.build_only:
-            continue
+    for rule in rules:
         view = application.view_finder.find(rule.endpoint)
         if not getattr(view, 'is_api_method', False):
             continue
@@ -202,12 +720,98 @@ def list_api_methods():
         result.append(dict(
             handler=handler,
             valid_methods=view.valid_methods,
-            doc=format_rst((inspect.getdoc(view) or '').decode('utf-8')),
+            doc=_render_doc(inspect.getdoc(view) or ''),
             url=unicode(rule)
         ))
     result.sort(key=lambda x: (x['url'], x['handler']))
     return result
 
+
+def list_api_methods():
+    """List all API methods. The list is built on first use and rebuilt
+    only if the URL rules of the application change."""
+    application = get_app()
+    rules = [rule for rule in application.map.iter_rules()
+             if not rule.build_only]
+    routes = [(rule.rule, rule.endpoint) for rule in rules]
+    cached = _api_indexes.get(application)
+    if cached is None or cached[0] != routes:
+        cached = _api_indexes[application] = \
+            (routes, _build_api_index(application, rules))
+    return list(cached[1])
+
+
+def api_help(request):
+    """View rendering the API help page from the cached method list."""
+    return Response(render_template('api/help.html',
+                                    methods=list_api_methods(),
+                                    xmlns=XML_NS), mimetype='text/html')
+
+
+def _soap_param_names(client, service):
+    """Returns the parameter names of the SOAP operation ``service``."""
+    method = getattr(client.service, service).method
+    return [name for name, type_ in method.binding.input.param_defs(method)]
+
+
+def _soap_cache_key(service, params, args, kwargs, cache_args=None):
+    """Returns the cache key of a call. The arguments are matched to the
+    parameter names ``params`` of the operation, so positional and keyword
+    calls share their entries."""
+    values = dict(zip(params, args))
+    values.update(kwargs)
+    if cache_args is None:
+        key = sorted(values.iteritems())
+    else:
+        key = []
+        for arg in cache_args:
+            if isinstance(arg, (int, long)):
+                if not 0 <= arg < len(params):
+                    raise ValueError('%s has no parameter %d' % (service, arg))
+                arg = params[arg]
+            elif arg not in params:
+                raise ValueError('%s has no parameter %r' % (service, arg))
+            key.append(values.get(arg))
+    return '%s:%s' % (service, hashlib.sha1(repr(key)).hexdigest())
+
+
+def _cached_soap_call(request, service, func, args, kwargs, options, params):
+    """Calls ``func`` unless the beaker cache of the request holds a result
+    younger than the ``cache_expire`` option. If the call fails, an older
+    result is returned instead of the error. ``params`` are the parameter
+    names of the operation."""
+    manager = request.environ.get('beaker.cache')
+    if manager is None:
+        return func(*args, **kwargs)
+    cache_kwargs = {}
+    if options.get('cache_stale') is not None:
+        cache_kwargs['expire'] = options['cache_stale']
+    cache = manager.get_cache(options.get('cache_namespace',
+                                          'soap.%s' % service),
+                              **cache_kwargs)
+    key = _soap_cache_key(service, params, args, kwargs,
+                          options.get('cache_args'))
+
+    try:
+        entry = cache.get(key)
+    except KeyError:
+        entry = None
+    now = time.time()
+    if entry is not None and now - entry[0] < options['cache_expire']:
+        return entry[1]
+
+    try:
+        # Exported, so the result can be pickled by every beaker backend.
+        result = remote_export_primitive(func(*args, **kwargs))
+    except (WebFault, URLError), exc:
+        if entry is None:
+            raise
+        log.warning('SOAP request failed, using the cached result: %r' % exc)
+        return entry[1]
+    cache.put(key, (now, result))
+    return result
+
+
 def SOAPActionFactory(client, service, options=None):
     """Creates a single action for a SOAP-enabled controller for an action taken
     from a subs-WSDL object.
@@ -215,83 +819,432 @@ def SOAPActionFactory(client, service, options=None):
     :param options: Dictionary with options::
         extra_kwargs: Add additional kwargs to every extracted method.
         methods: tuple of allowed HTTP methods. Defaults to ('GET',)
+        cache_expire: Seconds results are cached in the beaker cache of
+            the request. Not cached if missing.
+        cache_args: Positions and names of the parameters of the operation
+            forming the cache key. Defaults to all arguments.
+        cache_namespace: Beaker namespace. Defaults to 'soap.<method>'.
+        cache_stale: Seconds a result is kept to be returned when the
+            backend fails after it expired. Defaults to no limit.
+        timeout: Timeout of the SOAP call in seconds, unless the caller
+            sets one, see :func:`set_call_timeout`.
+        breaker: Options of the circuit breaker of the method, see
+            :class:`CircuitBreaker`, or False to disable it.
 
     :return: function or None"""
 
     options = options or {}
-
-    func = getattr(client.service, service)
     methods = options.get('methods', ('GET',))
+    wsdl = getattr(client, 'wsdl', None)
+    breaker = options.get('breaker', {})
+    if breaker is not False:
+        breaker = get_circuit_breaker('%s:%s' % (getattr(wsdl, 'url', wsdl),
+                                                 service), **breaker)
+
+    def func(*args, **kwargs):
+        # Looked up on every call, so lazy clients are only created once
+        # a SOAP method is actually used.
+        method = getattr(client.service, service)
+        timeout = options.get('timeout')
+        if timeout is None or get_call_timeout() is not None:
+            return method(*args, **kwargs)
+        set_call_timeout(timeout)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            set_call_timeout(None)
+
+    # Read from the WSDL on the first cached call
+    param_names = []
 
     def _method(self, request, *args, **kwargs):
         """Closure for SOAPActionFactory-generated methods."""
         kwargs.update(options.get('extra_kwargs', {}))
+        if options.get('cache_expire') is not None:
+            if not param_names:
+                param_names.extend(_soap_param_names(client, service))
+            return _cached_soap_call(request, service, func, args, kwargs,
+                                     options, param_names)
         return func(*args, **kwargs)
 
     # on_method makes the api_method decorator work for 'methods'
-    _method = soap_api_method(methods)(_method)
+    _method = soap_api_method(methods, breaker)(_method)
 
     # Suds does not set a value by itself.
     _method.__name__ = str(service)
-    # Provides undecorated access to the function
-    _method._func = func
+    # Provides undecorated access to the function, still behind the breaker
+    if breaker is False:
+        _method._func = func
+    else:
+        _method._func = lambda *args, **kwargs: \
+            breaker.call(func, *args, **kwargs)
 
     return _method
 
-def SOAPControllerFactory(wsdl, map=None):
+
+#: Where :class:`LazySOAPClient` caches parsed WSDL files by default, set
+#: it before the controllers are created. The cache holds pickles, so it
+#: must be a directory only the application user can write to; None
+#: disables the cache.
+WSDL_CACHE_DIR = None
+
+#: Number of threads running the SOAP calls of :func:`call_concurrently`
+SOAP_POOL_SIZE = 8
+
+
+def _call_with_timeout(func, args, kwargs, timeout):
+    previous = set_call_timeout(timeout)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        set_call_timeout(previous)
+
+
+def call_concurrently(controller, calls, timeout=None):
+    """Runs the SOAP methods of a controller created by
+    :func:`SOAPControllerFactory` concurrently on a thread pool of
+    :data:`SOAP_POOL_SIZE` threads and returns their results in order.
+    ``calls`` is a list of ``(name, args, kwargs)`` tuples, args and kwargs
+    may be left out. ``timeout`` applies to each call. The calls go through
+    the circuit breakers of their methods. If a call fails, the exception
+    of the first failed one is raised once all finished::
+
+        user, badges = self.call_concurrently([
+            ('GetUser', (user_id,)),
+            ('GetBadges', (), {'user': user_id}),
+        ], timeout=5)
+    """
+    pool = _get_thread_pool('soap', SOAP_POOL_SIZE)
+    pending = []
+    for call in calls:
+        name, args, kwargs = (tuple(call) + ((), {})[len(call) - 1:])[:3]
+        func = getattr(controller, name)._func
+        pending.append(pool.apply_async(_call_with_timeout,
+                                        (func, args, kwargs, timeout)))
+    results = []
+    error = None
+    for result in pending:
+        try:
+            results.append(result.get())
+        except Exception, e:
+            error = error or e
+            results.append(None)
+    if error is not None:
+        raise error
+    return results
+
+
+def _private_directory(path):
+    """Creates ``path`` with mode 0700 if it does not exist. Returns False
+    if it is not a directory owned by the current user that no one else
+    can access."""
+    try:
+        os.makedirs(path, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            log.warning('Could not create %s: %s' % (path, e))
+            return False
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+       info.st_mode & 077:
+        log.warning('%s is not a private directory of this user' % path)
+        return False
+    return True
+
+
+def list_soap_methods(client):
+    """Returns the names of the methods of a suds client."""
+    method_list = []
+    # This seems quite intensive, but most times there's only one element
+    # per loop.
+    for definition in client.sd:
+        for port in definition.service.ports:
+            method_list.extend(unicode(method)
+                               for method in port.methods.iterkeys())
+    return method_list
+
+
+_WSDL_NS = 'http://schemas.xmlsoap.org/wsdl/'
+_SOAP_BINDING_TAGS = ('{http://schemas.xmlsoap.org/wsdl/soap/}binding',
+                      '{http://schemas.xmlsoap.org/wsdl/soap12/}binding')
+
+
+def scan_wsdl_methods(path):
+    """Returns the operation names of the SOAP ports of the WSDL file
+    ``path`` like :func:`list_soap_methods`, but reads only the WSDL itself
+    and resolves no schemas. Returns None if the file imports other WSDL
+    documents or cannot be read this way."""
+    try:
+        root = etree.parse(path).getroot()
+    except (IOError, SyntaxError), e:
+        log.debug('Could not scan %s: %s' % (path, e))
+        return None
+    if root.find('{%s}import' % _WSDL_NS) is not None:
+        return None
+    bindings = dict((binding.get('name'), binding) for binding in
+                    root.findall('{%s}binding' % _WSDL_NS))
+    method_list = []
+    for port in root.findall('{%s}service/{%s}port' % (_WSDL_NS, _WSDL_NS)):
+        binding = bindings.get(port.get('binding', '').split(':')[-1])
+        if binding is None:
+            return None
+        # suds drops the ports of bindings other than SOAP
+        if not any(binding.find(tag) is not None
+                   for tag in _SOAP_BINDING_TAGS):
+            continue
+        method_list.extend(unicode(operation.get('name')) for operation in
+                           binding.findall('{%s}operation' % _WSDL_NS))
+    return method_list
+
+
+class LazySOAPClient(object):
+    """Stands in for the suds client of ``wsdl`` and creates it on first
+    use. The method names of local WSDL files are read with
+    :func:`scan_wsdl_methods`, so listing them does not create the client.
+    For local WSDL files the parsed WSDL and the method list are
+    cached in ``cache_dir``, keyed by path and modification time, so the
+    WSDL and its schemas are parsed only once. ``cache_dir`` defaults to
+    :data:`WSDL_CACHE_DIR`, False disables the cache. The cache is not used
+    unless ``cache_dir`` is a private directory of the current user, see
+    :func:`_private_directory`."""
+
+    def __init__(self, wsdl, cache_dir=None):
+        self.wsdl = wsdl
+        self.cache_location = None
+        path = wsdl.startswith('file://') and wsdl[7:] or wsdl
+        self.path = os.path.isfile(path) and path or None
+        if cache_dir is None:
+            cache_dir = WSDL_CACHE_DIR
+        if cache_dir and os.path.isfile(path) and \
+           _private_directory(cache_dir):
+            self.cache_location = os.path.join(
+                cache_dir, '%s-%d' % (
+                    hashlib.sha1(os.path.abspath(path)).hexdigest(),
+                    os.stat(path).st_mtime))
+        self._client = None
+        self._lock = Lock()
+        self._local = thread_local()
+
+    @property
+    def client(self):
+        """The suds client, created on first access."""
+        if self._client is None:
+            self._lock.acquire()
+            try:
+                if self._client is None:
+                    self._client = self._create_client()
+            finally:
+                self._lock.release()
+        return self._client
+
+    @property
+    def service(self):
+        """The service of a clone of the client per thread, as suds
+        clients keep state per call. The clones share the connections."""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.client.clone()
+        return client.service
+
+    def _create_client(self):
+        transport = KeepAliveTransport()
+        if self.cache_location is None:
+            return suds.client.Client(self.wsdl, cache=None,
+                                      transport=transport)
+        # cachingpolicy 1 pickles the parsed WSDL instead of the documents
+        return suds.client.Client(self.wsdl, cachingpolicy=1,
+                                  cache=ObjectCache(self.cache_location,
+                                                    days=0),
+                                  transport=transport)
+
+    def methods(self):
+        """Returns the method names, if possible without creating the
+        client."""
+        if self.path is not None:
+            method_list = scan_wsdl_methods(self.path)
+            if method_list is not None:
+                return method_list
+        if self.cache_location is None:
+            return list_soap_methods(self.client)
+        filename = os.path.join(self.cache_location, 'methods.json')
+        try:
+            f = open(filename)
+            try:
+                return simplejson.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            pass
+        method_list = list_soap_methods(self.client)
+        try:
+            if not os.path.isdir(self.cache_location):
+                os.makedirs(self.cache_location)
+            tmp = '%s.%d' % (filename, os.getpid())
+            f = open(tmp, 'w')
+            try:
+                simplejson.dump(method_list, f)
+            finally:
+                f.close()
+            os.rename(tmp, filename)
+        except (IOError, OSError), e:
+            log.warning('Could not cache the methods of %s: %s' % (
+                self.wsdl, e))
+        return method_list
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def SOAPControllerFactory(wsdl, map=None, methods=None, cache_dir=None):
     """Creates a Mixin including all methods specified in the WSDL supplied.
     They are valid api methods that can be overridden.
 
+    The suds client is created on the first call of one of the methods.
+    The method list of a local WSDL file is read without it, see
+    :meth:`LazySOAPClient.methods`. Remote WSDLs and WSDLs importing
+    others need the client unless ``methods`` is passed or the list is in
+    the WSDL cache.
+
     :param wsdl: path to wsdl file.
     :param map: dictionary with method name as key and options to be passed to
     SOAPActionFactory. Key _all matches all methods.
+    :param methods: precompiled list of method names, see
+    :func:`list_soap_methods`.
+    :param cache_dir: directory of the WSDL cache or False.
     :return: class that can either be used as mixin or standalone base.
     """
 
     map = map or {}
-    client = suds.client.Client(wsdl, cache=None)
+    client = LazySOAPClient(wsdl, cache_dir)
+    if methods is None:
+        methods = client.methods()
 
     class _ControllerMixin(object):
-        pass
-
-    method_list = []
-    # This seems quite intensive, but most times there's only one element
-    # per loop.
-    for definition in client.sd:
-        for port in definition.service.ports:
-            for method in port.methods.iterkeys():
-                method_list.append(method)
+        call_concurrently = call_concurrently
 
-                # Find global options and update with method specific
-                options = map.get('_all', {})
-                options.update(map.get(method, {}))
-                func = SOAPActionFactory(client, method, options)
-                setattr(_ControllerMixin, method, func)
+    for method in methods:
+        # Find global options and update with method specific
+        options = dict(map.get('_all', {}))
+        options.update(map.get(method, {}))
+        func = SOAPActionFactory(client, method, options)
+        setattr(_ControllerMixin, method, func)
 
     # Make the list available as protected attribute
-    _ControllerMixin._soap_methods = method_list
+    _ControllerMixin._soap_methods = list(methods)
+    _ControllerMixin._soap_client = client
     _ControllerMixin._wsdl_path = wsdl
 
     return _ControllerMixin
 
 
+register_serializer('json', dump_json, 'application/json',
+                    stream=iter_dump_json)
+register_serializer('xml', dump_xml, 'application/xml',
+                    mimetypes=('application/xml', 'text/xml'),
+                    stream=iter_dump_xml_encoded)
+register_serializer('debug', debug_dump, 'text/html')
+register_serializer('msgpack', dump_msgpack, MSGPACK_MIMETYPE, raw=True)
 
-_serializer_for_mimetypes = {
-    'application/json':     'json',
-    'application/xml':      'xml',
-    'text/xml':             'xml',
-    'text/html':            'debug',
-}
-_serializer_map = {
-    'json':     (simplejson.dumps, 'application/json'),
-    'xml':      (dump_xml, 'application/xml'),
-    'debug':    (debug_dump, 'text/html')
+# The registry lives in rdreilib.serializers, formats registered there
+# are available here as well.
+_serializer_map = serializers
+_serializer_for_mimetypes = serializer_mimetypes
+_stream_serializer_map = stream_serializers
+on_serializers_changed(_negotiated_formats.clear)
+
+#: the zlib window bits for the supported content encodings
+_compressor_wbits = {
+    'gzip':     16 + zlib.MAX_WBITS,
+    'deflate':  zlib.MAX_WBITS,
 }
 
 def setup_api(app):
     """Glashammer setup. Use this if you want to use this module."""
     app.add_config_var('api/xml_ns', str, 'http://rdrei.net/api')
+    app.add_config_var('api/compress_level', int, 6)
+    app.add_config_var('api/compress_min_size', int, 1024)
     app.add_template_searchpath(os.path.join(
         os.path.dirname(__file__),
         'templates/'
     ))
+
+
+__test__ = {'call_concurrently': r"""
+The calls run at the same time, with the timeout set for each of them:
+
+>>> def get_user(*args, **kwargs):
+...     time.sleep(0.2)
+...     return args, kwargs, get_call_timeout()
+>>> class Method(object):
+...     _func = staticmethod(get_user)
+>>> class Controller(object):
+...     GetUser = Method()
+>>> start = time.time()
+>>> call_concurrently(Controller(), [('GetUser', (1,)),
+...                                  ('GetUser', (), {'user': 2}),
+...                                  ('GetUser',)], timeout=5)
+[((1,), {}, 5), ((), {'user': 2}, 5), ((), {}, 5)]
+>>> time.time() - start < 0.4
+True
+""", 'wsdl': r"""
+The methods of a local WSDL file are listed without creating the client:
+
+>>> import shutil, tempfile
+>>> directory = tempfile.mkdtemp()
+>>> wsdl = os.path.join(directory, 'echo.wsdl')
+>>> f = open(wsdl, 'w')
+>>> f.write('''<?xml version="1.0"?>
+... <definitions targetNamespace="urn:echo" xmlns:tns="urn:echo"
+...     xmlns="http://schemas.xmlsoap.org/wsdl/"
+...     xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+...     xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+...  <types><xsd:schema targetNamespace="urn:echo"
+...      elementFormDefault="qualified">
+...   <xsd:element name="Echo"><xsd:complexType><xsd:sequence>
+...    <xsd:element name="text" type="xsd:string"/>
+...   </xsd:sequence></xsd:complexType></xsd:element>
+...  </xsd:schema></types>
+...  <message name="EchoIn"><part name="in" element="tns:Echo"/></message>
+...  <portType name="EchoPort"><operation name="Echo">
+...   <input message="tns:EchoIn"/><output message="tns:EchoIn"/>
+...  </operation></portType>
+...  <binding name="EchoBinding" type="tns:EchoPort">
+...   <soap:binding style="document"
+...       transport="http://schemas.xmlsoap.org/soap/http"/>
+...   <operation name="Echo"><soap:operation soapAction="Echo"/>
+...    <input><soap:body use="literal"/></input>
+...    <output><soap:body use="literal"/></output>
+...   </operation></binding>
+...  <service name="EchoService"><port name="EchoPort"
+...      binding="tns:EchoBinding">
+...   <soap:address location="http://127.0.0.1:1/echo"/>
+...  </port></service>
+... </definitions>''')
+>>> f.close()
+>>> scan_wsdl_methods(wsdl)
+[u'Echo']
+>>> Mixin = SOAPControllerFactory('file://' + wsdl)
+>>> Mixin._soap_methods, Mixin._soap_client._client
+([u'Echo'], None)
+>>> list_soap_methods(Mixin._soap_client.client)
+[u'Echo']
+>>> [str(name) for name in _soap_param_names(Mixin._soap_client, 'Echo')]
+['text']
+
+The WSDL cache is only used in a private directory:
+
+>>> cache_dir = os.path.join(directory, 'cache')
+>>> client = LazySOAPClient('file://' + wsdl, cache_dir)
+>>> client.cache_location.startswith(cache_dir), client.methods()
+(True, [u'Echo'])
+>>> oct(stat.S_IMODE(os.stat(cache_dir).st_mode))
+'0700'
+>>> os.chmod(cache_dir, 0755)
+>>> print LazySOAPClient('file://' + wsdl, cache_dir).cache_location
+None
+>>> shutil.rmtree(directory)
+"""}
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
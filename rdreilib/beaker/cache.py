@@ -9,7 +9,9 @@ Glashammer bundle for beaker cache.
 """
 
 from .utils import make_beaker_dict_from_config
+from ..pagination import track_table_versions
 from beaker.middleware import CacheMiddleware
+from glashammer.utils.local import get_request
 
 
 def _enhance_request(req):
@@ -18,6 +20,14 @@ def _enhance_request(req):
     req.set_cache(req.environ['beaker.cache'])
 
 
+def _get_request_cache():
+    """Returns the beaker cache of the current request, if any."""
+    try:
+        return get_request().environ.get('beaker.cache')
+    except AttributeError:
+        return None
+
+
 def setup_cache(app):
     app.add_config_var("cache/enabled", bool, False)
     app.add_config_var("cache/expire", int, None)
@@ -35,4 +45,12 @@ def setup_cache(app):
     app.add_middleware(CacheMiddleware, config)
     app.connect_event('request-start', _enhance_request)
 
-__all__ = ('setup_cache',)
+
+def setup_page_cache(app):
+    """Sets up the beaker cache and keeps the table versions used by
+    :class:`rdreilib.pagination.PageCache` current. Tables written outside
+    of a request are not tracked."""
+    app.add_setup(setup_cache)
+    track_table_versions(_get_request_cache)
+
+__all__ = ('setup_cache', 'setup_page_cache')
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+ rdreilib.circuitbreaker
+ ~~~~~~~~~~~~~~~~~~~~~~~
+ Circuit breakers for calls to remote services. A breaker watches the last
+ calls of an operation and opens once too many of them failed or were too
+ slow. While it is open, calls fail immediately instead of waiting for the
+ backend. After a cooldown one probe call is let through (half-open); if it
+ succeeds the breaker closes again.
+
+ Breakers are registered by name, :func:`circuit_breaker_status` returns
+ the state of all of them for monitoring.
+
+ :copyright: 2026 by the rdreilib team, see doc/AUTHORS for more details.
+ :license: BSD, see doc/LICENSE for more details.
+"""
+import time
+from collections import deque
+from threading import Lock
+
+import logging
+
+log = logging.getLogger('rdreilib.circuitbreaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """Raised by :meth:`CircuitBreaker.call` while the breaker is open."""
+
+
+class CircuitBreaker(object):
+    """Breaker for one operation.
+
+    :param window: number of recent calls the error rate is computed of.
+    :param min_calls: calls needed in the window before the breaker opens.
+    :param error_rate: share of failed calls opening the breaker.
+    :param slow_call: seconds after which a call counts as failed, even if
+        it succeeded. None disables the latency budget.
+    :param cooldown: seconds the breaker stays open before the probe.
+    """
+
+    def __init__(self, name, window=20, min_calls=10, error_rate=0.5,
+                 slow_call=None, cooldown=30):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = None
+        self._calls = deque(maxlen=window)
+        self._probing = False
+        self._lock = Lock()
+
+    def allow(self):
+        """Returns True if a call may be made now. In the half-open state
+        only one caller gets True until it reported its result."""
+        if self.state == CLOSED:
+            return True
+        self._lock.acquire()
+        try:
+            if self.state == OPEN and \
+               time.time() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return self.state == CLOSED
+        finally:
+            self._lock.release()
+
+    def record(self, success, duration):
+        """Records the result of a call that took ``duration`` seconds."""
+        failed = not success or (self.slow_call is not None and
+                                 duration > self.slow_call)
+        self._lock.acquire()
+        try:
+            self._calls.append((failed, duration))
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._open()
+                else:
+                    log.info('Circuit %s closed' % self.name)
+                    self.state = CLOSED
+                    self._calls.clear()
+            elif self.state == CLOSED and failed and \
+                 len(self._calls) >= self.min_calls and \
+                 self._failure_rate() >= self.error_rate:
+                self._open()
+        finally:
+            self._lock.release()
+
+    def call(self, func, *args, **kwargs):
+        """Calls ``func`` and records the result. Raises `CircuitOpenError`
+        instead if no call may be made now."""
+        if not self.allow():
+            raise CircuitOpenError('Circuit %s is open' % self.name)
+        start = time.time()
+        success = False
+        try:
+            result = func(*args, **kwargs)
+            success = True
+            return result
+        finally:
+            self.record(success, time.time() - start)
+
+    def _open(self):
+        log.warning('Circuit %s opened' % self.name)
+        self.state = OPEN
+        self.opened_at = time.time()
+
+    def _failure_rate(self):
+        if not self._calls:
+            return 0.0
+        return sum(1 for failed, duration in self._calls
+                   if failed) / float(len(self._calls))
+
+    def reset(self):
+        """Closes the breaker and forgets the recorded calls."""
+        self._lock.acquire()
+        try:
+            self.state = CLOSED
+            self.opened_at = None
+            self._probing = False
+            self._calls.clear()
+        finally:
+            self._lock.release()
+
+    def status(self):
+        """Returns the state and the statistics of the recent calls."""
+        self._lock.acquire()
+        try:
+            durations = [duration for failed, duration in self._calls]
+            return {
+                'name': self.name,
+                'state': self.state,
+                'opened_at': self.opened_at,
+                'calls': len(durations),
+                'failure_rate': self._failure_rate(),
+                'mean_duration': durations and
+                    sum(durations) / len(durations) or 0.0,
+                'max_duration': durations and max(durations) or 0.0,
+            }
+        finally:
+            self._lock.release()
+
+
+_breakers = {}
+_breakers_lock = Lock()
+
+
+def get_circuit_breaker(name, **options):
+    """Returns the breaker ``name``, creating it with ``options`` if it
+    does not exist yet."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        _breakers_lock.acquire()
+        try:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name, **options)
+        finally:
+            _breakers_lock.release()
+    return breaker
+
+
+def circuit_breaker_status():
+    """Returns the status of all breakers, sorted by name."""
+    return [_breakers[name].status() for name in sorted(_breakers)]
@@ -15,7 +15,8 @@ from glashammer.bundles.i18n import LazyString
 from glashammer.utils.lazystring import LazyString
 from werkzeug.wrappers import Response
 from werkzeug.exceptions import HTTPException
-from simplejson import dumps as dump_json, JSONEncoder
+from simplejson import JSONEncoder
+from serializers import dump_json, lookup_serializer, json_default
 from functools import wraps
 import traceback, logging
 
@@ -42,12 +43,7 @@ class LazyEncoder(JSONEncoder):
     json-able with the default encoder."""
 
     def default(self, o):
-        if isinstance(o, _LazyString):
-            return unicode(o)
-        elif hasattr(o, '__json__'):
-            return o.__json__()
-        else:
-            super(LazyEncoder, self).default(o)
+        return json_default(o)
 
 class JsonResponse(Response):
     default_mimetype = 'application/json'
@@ -56,7 +52,8 @@ class JsonResponse(Response):
         #default = kw.get("json_encoder", None)
         #if default:
         #    del kw['json_encoder']
-        Response.__init__(self, dump_json(data, cls=LazyEncoder), *args, **kw)
+        dump, mimetype = lookup_serializer('json')
+        Response.__init__(self, dump(data), *args, **kw)
 
 def json_view(f, encoder=None):
     """
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+ rdreilib.metrics
+ ~~~~~~~~~~~~~~~~
+ Per-process histograms of the API handlers: wall time in total, in the
+ view, exporting and serializing the result, and the size of the response.
+ :func:`rdreilib.api.api_method` records every call.
+
+ The histograms are returned by :func:`metrics_snapshot`. Sinks registered
+ with :func:`add_metrics_sink` get every call as it is recorded, e.g. a
+ :class:`StatsdSink` sending it to a statsd daemon::
+
+    add_metrics_sink(StatsdSink('127.0.0.1', 8125, prefix='myapp.api'))
+
+ :copyright: 2026 by the rdreilib team, see doc/AUTHORS for more details.
+ :license: BSD, see doc/LICENSE for more details.
+"""
+import socket
+from bisect import bisect_left
+from threading import Lock
+
+import logging
+
+log = logging.getLogger('rdreilib.metrics')
+
+#: Upper bounds of the buckets of time histograms in milliseconds
+TIME_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+#: Upper bounds of the buckets of size histograms in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+#: The figures recorded per call, the last one is a size in bytes
+METRICS = ('total', 'view', 'export', 'serialize', 'bytes')
+
+#: Set to False to stop recording
+enabled = True
+
+
+class Histogram(object):
+    """Counts values in buckets with the upper bounds ``buckets``, plus
+    one bucket for larger values."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        self._lock = Lock()
+
+    def add(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def snapshot(self):
+        """Returns the figures as dict, the buckets as ``(upper bound,
+        count)`` pairs with None as bound of the last one."""
+        with self._lock:
+            return {
+                'count': self.count,
+                'sum': self.sum,
+                'mean': self.count and float(self.sum) / self.count or 0.0,
+                'min': self.min,
+                'max': self.max,
+                'buckets': zip(self.buckets + (None,), self.counts),
+            }
+
+
+_histograms = {}
+_histograms_lock = Lock()
+_sinks = []
+
+
+def _get_histogram(handler, metric):
+    key = (handler, metric)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = Histogram(
+                    metric == 'bytes' and SIZE_BUCKETS or TIME_BUCKETS)
+    return histogram
+
+
+def record_call(handler, figures):
+    """Records one call of ``handler``. ``figures`` maps the names of
+    :data:`METRICS` to milliseconds and bytes, missing ones are skipped."""
+    if not enabled:
+        return
+    for metric in METRICS:
+        if metric in figures:
+            _get_histogram(handler, metric).add(figures[metric])
+    for sink in _sinks:
+        try:
+            sink(handler, figures)
+        except Exception:
+            log.exception('Metrics sink %r failed' % sink)
+
+
+def metrics_snapshot():
+    """Returns the histograms of all handlers, sorted by handler."""
+    result = []
+    for (handler, metric), histogram in sorted(_histograms.items()):
+        snapshot = histogram.snapshot()
+        snapshot.update(handler=handler, metric=metric)
+        result.append(snapshot)
+    return result
+
+
+def reset_metrics():
+    """Drops all histograms."""
+    with _histograms_lock:
+        _histograms.clear()
+
+
+def add_metrics_sink(sink):
+    """Registers ``sink``, a callable getting the handler and the figures
+    of every recorded call."""
+    _sinks.append(sink)
+
+
+def remove_metrics_sink(sink):
+    _sinks.remove(sink)
+
+
+class StatsdSink(object):
+    """Sends the figures of every call as one UDP packet in the statsd line
+    format, times as timers and the size as histogram::
+
+        api.get_user.view:3.21|ms
+        api.get_user.bytes:1204|h
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='api'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, handler, figures):
+        lines = []
+        for metric in METRICS:
+            if metric in figures:
+                if metric == 'bytes':
+                    value = '%d|h' % figures[metric]
+                else:
+                    value = '%.3f|ms' % figures[metric]
+                lines.append('%s.%s.%s:%s' % (self.prefix, handler, metric,
+                                              value))
+        try:
+            self._socket.sendto('\n'.join(lines), self.address)
+        except socket.error, e:
+            # statsd is best effort, a missing daemon must not fail calls
+            log.debug('Could not send metrics: %s' % e)
+
+
+__test__ = {'statsd': r"""
+Recorded calls go into the histograms and to the sinks, here a
+:class:`StatsdSink` sending to a local listener:
+
+>>> listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+>>> listener.bind(('127.0.0.1', 0))
+>>> host, port = listener.getsockname()
+>>> sink = StatsdSink(host, port, prefix='test')
+>>> add_metrics_sink(sink)
+>>> record_call('get_user', {'total': 12.5, 'view': 10, 'bytes': 1204})
+>>> print listener.recv(4096)
+test.get_user.total:12.500|ms
+test.get_user.view:10.000|ms
+test.get_user.bytes:1204|h
+>>> remove_metrics_sink(sink)
+>>> for snapshot in metrics_snapshot():
+...     print snapshot['handler'], snapshot['metric'], snapshot['count'], \
+...         [bucket for bucket in snapshot['buckets'] if bucket[1]]
+get_user bytes 1 [(4096, 1)]
+get_user total 1 [(20, 1)]
+get_user view 1 [(10, 1)]
+>>> reset_metrics()
+>>> metrics_snapshot()
+[]
+"""}
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+ rdreilib.msgpacklib
+ ~~~~~~~~~~~~~~~~~~~
+ MessagePack output for the API, a compact binary alternative to JSON for
+ service to service calls.
+
+ Datetimes are written as MessagePack timestamps (extension type -1),
+ including the ``solace.datetime`` dicts of :func:`remote_export_primitive`.
+ The `msgpack` package (1.0 or later) is used if it is installed, otherwise
+ the data is packed in pure Python.
+
+ :copyright: 2026 by the rdreilib team, see doc/AUTHORS for more details.
+ :license: BSD, see doc/LICENSE for more details.
+"""
+from calendar import timegm
+from datetime import datetime
+from struct import pack
+
+from babel import Locale
+from glashammer.utils.lazystring import is_lazy_string
+
+from .remoting import RemoteObject
+
+try:
+    import msgpack
+    # releases before 1.0 refuse the negative timestamp extension type
+    msgpack.ExtType(-1, '')
+except (ImportError, AttributeError, ValueError):
+    msgpack = None
+
+
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+#: The extension type of MessagePack timestamps
+TIMESTAMP_EXT = -1
+
+
+def _timestamp_seconds(value):
+    """Parses the '%Y-%m-%dT%H:%M:%SZ' value of a solace.datetime."""
+    return timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                   int(value[11:13]), int(value[14:16]), int(value[17:19])))
+
+
+def pack_timestamp(seconds, nanoseconds=0):
+    """Returns the payload of a timestamp extension in the smallest of the
+    three layouts of the MessagePack spec."""
+    if seconds >> 34 == 0:
+        if nanoseconds == 0 and seconds >> 32 == 0:
+            return pack('>I', seconds)
+        return pack('>Q', nanoseconds << 34 | seconds)
+    return pack('>Iq', nanoseconds, seconds)
+
+
+def _datetime_timestamp(obj):
+    return pack_timestamp(timegm(obj.utctimetuple()), obj.microsecond * 1000)
+
+
+class _Timestamp(object):
+    """The packed payload of a timestamp extension."""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+def _export(obj):
+    """Like :func:`remote_export_primitive` but keeps datetimes and turns
+    ``solace.datetime`` dicts into timestamp payloads."""
+    if isinstance(obj, RemoteObject):
+        obj = obj.remote_export()
+    if isinstance(obj, dict):
+        if obj.get('#type') == 'solace.datetime':
+            return _Timestamp(pack_timestamp(_timestamp_seconds(obj['value'])))
+        return dict((key, _export(value)) for key, value in obj.iteritems())
+    if isinstance(obj, basestring):
+        return obj
+    # lazy strings are iterable proxies, they must not be taken for lists
+    if is_lazy_string(obj) or isinstance(obj, Locale):
+        return unicode(obj)
+    if hasattr(obj, '__iter__'):
+        return map(_export, obj)
+    if isinstance(obj, datetime):
+        return _Timestamp(_datetime_timestamp(obj))
+    return obj
+
+
+def _pack_length(length, write, fix, fix_max, codes):
+    if length <= fix_max:
+        write(chr(fix | length))
+    elif length < 0x10000:
+        write(pack('>BH', codes[0], length))
+    else:
+        write(pack('>BI', codes[1], length))
+
+
+_uint_formats = ((0xcc, '>BB', 1 << 8), (0xcd, '>BH', 1 << 16),
+                 (0xce, '>BI', 1 << 32), (0xcf, '>BQ', 1 << 64))
+_int_formats = ((0xd0, '>Bb', -1 << 7), (0xd1, '>Bh', -1 << 15),
+                (0xd2, '>Bi', -1 << 31), (0xd3, '>Bq', -1 << 63))
+
+
+def _pack(obj, write):
+    if obj is None:
+        write('\xc0')
+    elif obj is True:
+        write('\xc3')
+    elif obj is False:
+        write('\xc2')
+    elif isinstance(obj, (int, long)):
+        if 0 <= obj < 0x80:
+            write(chr(obj))
+        elif -0x20 <= obj < 0:
+            write(chr(obj & 0xff))
+        elif obj >= 0:
+            for code, format, limit in _uint_formats:
+                if obj < limit:
+                    write(pack(format, code, obj))
+                    break
+            else:
+                raise OverflowError('integer out of range: %d' % obj)
+        else:
+            for code, format, limit in _int_formats:
+                if obj >= limit:
+                    write(pack(format, code, obj))
+                    break
+            else:
+                raise OverflowError('integer out of range: %d' % obj)
+    elif isinstance(obj, float):
+        write(pack('>Bd', 0xcb, obj))
+    elif isinstance(obj, _Timestamp):
+        length = len(obj.data)
+        if length in (4, 8):
+            write(pack('>Bb', length == 4 and 0xd6 or 0xd7, TIMESTAMP_EXT))
+        else:
+            write(pack('>BBb', 0xc7, length, TIMESTAMP_EXT))
+        write(obj.data)
+    elif isinstance(obj, basestring):
+        if isinstance(obj, unicode):
+            obj = obj.encode('utf-8')
+        length = len(obj)
+        if length < 0x100 and length > 31:
+            write(pack('>BB', 0xd9, length))
+        else:
+            _pack_length(length, write, 0xa0, 31, (0xda, 0xdb))
+        write(obj)
+    elif isinstance(obj, dict):
+        _pack_length(len(obj), write, 0x80, 15, (0xde, 0xdf))
+        for key, value in obj.iteritems():
+            _pack(key, write)
+            _pack(value, write)
+    elif isinstance(obj, (list, tuple)):
+        _pack_length(len(obj), write, 0x90, 15, (0xdc, 0xdd))
+        for item in obj:
+            _pack(item, write)
+    else:
+        raise TypeError('%r can not be packed' % (obj,))
+
+
+def _default(obj):
+    if isinstance(obj, _Timestamp):
+        return msgpack.ExtType(TIMESTAMP_EXT, obj.data)
+    raise TypeError('%r can not be packed' % (obj,))
+
+
+def dump_msgpack(obj):
+    """Dumps ``obj`` into MessagePack. Strings are written as the str
+    type, byte strings are expected to be utf-8."""
+    obj = _export(obj)
+    if msgpack is not None:
+        return msgpack.packb(obj, default=_default, use_bin_type=False)
+    buf = []
+    _pack(obj, buf.append)
+    return ''.join(buf)
@@ -9,7 +9,21 @@
  :license: Dual lisenced under GPL v3 and BSD, see doc/LICENSE for more details.
 """
 from werkzeug import cached_property
-import math
+from sqlalchemy import and_, or_, func
+from sqlalchemy import event
+from sqlalchemy.orm import Session, class_mapper, object_mapper
+from sqlalchemy.orm.exc import UnmappedClassError
+from sqlalchemy.sql.util import find_tables
+from multiprocessing.pool import ThreadPool
+from threading import Lock, Thread
+from Queue import Queue, Full
+from p2lib import int_to_p2, p2_to_int
+from datetime import datetime, timedelta
+from itertools import islice
+from uuid import uuid4
+import base64, copy, hashlib, hmac, logging, math, re
+
+log = logging.getLogger('rdreilib.pagination')
 
 class InvalidPage(Exception):
     pass
@@ -20,14 +34,569 @@ class PageNotAnInteger(InvalidPage):
 class EmptyPage(InvalidPage):
     pass
 
+class InvalidCursor(InvalidPage):
+    pass
+
+_EPOCH = datetime(1970, 1, 1)
+
+def _encode_cursor_value(value):
+    if isinstance(value, bool) or value is None:
+        raise ValueError("Can not use %r as keyset value" % value)
+    if isinstance(value, (int, long)):
+        if value < 0:
+            return '_n' + int_to_p2(-value)
+        return int_to_p2(value) or '0'
+    if isinstance(value, datetime):
+        delta = value - _EPOCH
+        micro = (delta.days * 86400 + delta.seconds) * 10**6 + \
+                delta.microseconds
+        if micro < 0:
+            raise ValueError("Can not encode dates before 1970")
+        return '_t' + (int_to_p2(micro) or '0')
+    if isinstance(value, basestring):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return '_s' + base64.urlsafe_b64encode(value).rstrip('=')
+    raise ValueError("Can not use %r as keyset value" % value)
+
+def _decode_cursor_value(bit):
+    if not bit.startswith('_'):
+        return p2_to_int(bit)
+    tag, bit = bit[1:2], bit[2:]
+    if tag == 'n':
+        return -p2_to_int(bit)
+    if tag == 't':
+        return _EPOCH + timedelta(microseconds=p2_to_int(bit))
+    if tag == 's':
+        try:
+            value = base64.urlsafe_b64decode(bit + '=' * (-len(bit) % 4))
+            return value.decode('utf-8')
+        except (TypeError, UnicodeDecodeError):
+            raise ValueError("Invalid string value")
+    raise ValueError("Unknown value type %r" % tag)
+
+def encode_cursor(values):
+    """Encodes a tuple of keyset values into a short, URL-safe cursor.
+    Integers are written as p2 numbers, datetimes and strings carry a
+    small type prefix.
+
+    >>> encode_cursor((15, 4000))
+    'f.10v'
+    >>> decode_cursor(encode_cursor((15, 4000)))
+    (15, 4000)
+    >>> decode_cursor(encode_cursor((u'Bert', datetime(2009, 5, 1), 0)))
+    (u'Bert', datetime.datetime(2009, 5, 1, 0, 0), 0)
+    """
+    return '.'.join(map(_encode_cursor_value, values))
+
+def decode_cursor(cursor):
+    """Decodes a cursor created by :func:`encode_cursor` back into a tuple
+    of values. Raises `InvalidCursor` for malformed input.
+
+    >>> decode_cursor('f.!')
+    Traceback (most recent call last):
+    InvalidCursor: Malformed cursor 'f.!'
+    """
+    try:
+        return tuple(map(_decode_cursor_value, str(cursor).split('.')))
+    except (ValueError, UnicodeError):
+        raise InvalidCursor('Malformed cursor %r' % cursor)
+
+def _sign(payload, secret):
+    return hmac.new(secret, payload, hashlib.sha1).hexdigest()[:16]
+
+def _safe_str_cmp(a, b):
+    "Compares two strings in constant time."
+    if len(a) != len(b):
+        return False
+    rv = 0
+    for x, y in zip(a, b):
+        rv |= ord(x) ^ ord(y)
+    return rv == 0
+
+def _is_page_token(value):
+    return isinstance(value, basestring) and '.' in value
+
+def make_page_token(number, position, snapshot, secret):
+    """Returns a signed token for page ``number`` that continues after the
+    keyset ``position`` and ignores all rows beyond ``snapshot``.
+
+    >>> token = make_page_token(3, (15, 4000), 4711, 'secret')
+    >>> parse_page_token(token, 'secret')
+    (3, (15, 4000), 4711)
+    >>> parse_page_token(token, 'other secret')
+    Traceback (most recent call last):
+    InvalidCursor: Invalid page token
+    """
+    payload = encode_cursor((number, snapshot) + tuple(position))
+    return '%s.%s' % (payload, _sign(payload, secret))
+
+def parse_page_token(token, secret):
+    """Verifies a token created by `make_page_token` and returns its page
+    number, keyset position and snapshot bound."""
+    try:
+        payload, sep, signature = str(token).rpartition('.')
+    except UnicodeError:
+        sep = None
+    if not sep or not _safe_str_cmp(_sign(payload, secret), signature):
+        raise InvalidCursor('Invalid page token')
+    values = decode_cursor(payload)
+    if len(values) < 3:
+        raise InvalidCursor('Invalid page token')
+    return values[0], values[2:], values[1]
+
+def _order_query(query, columns, descending=False):
+    return query.order_by(None).order_by(*[
+        (column.desc() if descending else column.asc())
+        for column in columns])
+
+def _keyset_criterion(columns, values, descending=False):
+    """Returns the expanded form of ``(col1, col2) > (val1, val2)``, which
+    unlike row value comparison works on every database and still lets the
+    planner use a matching index."""
+    clauses = []
+    for idx, column in enumerate(columns):
+        if descending:
+            bound = column < values[idx]
+        else:
+            bound = column > values[idx]
+        clauses.append(and_(*[c == v for c, v in
+                              zip(columns[:idx], values[:idx])] + [bound]))
+    return or_(*clauses)
+
+def _keyset_values(obj, columns):
+    "Extracts the keyset position of ``obj``."
+    return tuple(getattr(obj, column.key) for column in columns)
+
+def exact_count(object_list):
+    "Returns the exact number of objects in a query or sequence."
+    try:
+        return object_list.count()
+    except (AttributeError, TypeError):
+        # AttributeError if object_list has no count() method.
+        # TypeError if object_list.count() requires arguments
+        # (i.e. is of type list).
+        return len(object_list)
+
+def query_fingerprint(object_list):
+    """Returns a hash of the SQL statement and the bound parameters of a
+    query, or None if ``object_list`` is not a query."""
+    statement = getattr(object_list, 'statement', None)
+    if statement is None:
+        return None
+    compiled = statement.compile()
+    return hashlib.sha1('%s\n%r' % (unicode(compiled).encode('utf-8'),
+                        sorted(compiled.params.items()))).hexdigest()
+
+class CountProvider(object):
+    """Base class for count providers, which the paginator calls with its
+    ``object_list`` to get the total. If ``approximate`` is True the result
+    is only used for the page ranges; pages themselves are fetched one row
+    ahead and correct the count where it was proven wrong."""
+    approximate = False
+
+    def __call__(self, object_list):
+        return exact_count(object_list)
+
+class CachedCount(CountProvider):
+    """Keeps counts in a beaker cache, keyed by the fingerprint of the
+    query, for ``expire`` seconds. Counts of anything but queries are not
+    cached.
+
+    Example use::
+
+        paginator = Paginator(query, 20,
+                              count_provider=CachedCount(req.cache))
+    """
+    approximate = True
+
+    def __init__(self, cache_manager, namespace='rdreilib.pagination.count',
+                 expire=300):
+        self.cache_manager = cache_manager
+        self.namespace = namespace
+        self.expire = expire
+
+    def __call__(self, object_list):
+        key = query_fingerprint(object_list)
+        if key is None:
+            return exact_count(object_list)
+        cache = self.cache_manager.get_cache(self.namespace,
+                                             expire=self.expire)
+        return cache.get(key, createfunc=lambda: exact_count(object_list))
+
+_pg_rows_re = re.compile(r'\brows=(\d+)')
+
+def _estimate_postgresql(connection, compiled, params):
+    plan = connection.execute('EXPLAIN ' + unicode(compiled), params)
+    match = _pg_rows_re.search(plan.scalar())
+    return match and int(match.group(1))
+
+def _estimate_mysql(connection, compiled, params):
+    rows = [row['rows'] for row in
+            connection.execute('EXPLAIN ' + unicode(compiled), params)]
+    if not rows or None in rows:
+        return None
+    return reduce(lambda x, y: x * y, map(int, rows))
+
+def _estimate_sqlite(connection, compiled, params):
+    # SQLite plans have no row estimates. ``ANALYZE`` stores the size of
+    # every indexed table though, which makes a rough local stand-in.
+    estimate = None
+    for table in find_tables(compiled.statement):
+        try:
+            stat = connection.execute('SELECT stat FROM sqlite_stat1 '
+                                      'WHERE tbl = ?', table.name).scalar()
+        except Exception:
+            # No sqlite_stat1 before the first ANALYZE.
+            return None
+        if stat is None:
+            return None
+        estimate = max(estimate, int(stat.split()[0]))
+    return estimate
+
+#: Maps dialect names to functions returning the planner's row estimate.
+planner_estimators = {
+    'postgresql':   _estimate_postgresql,
+    'mysql':        _estimate_mysql,
+    'sqlite':       _estimate_sqlite,
+}
+
+class EstimatedCount(CountProvider):
+    """Asks the query planner how many rows to expect instead of counting
+    them. Estimates below ``exact_below`` and queries on databases without
+    an entry in `planner_estimators` are counted exactly."""
+    approximate = True
+
+    def __init__(self, exact_below=1000):
+        self.exact_below = exact_below
+
+    def __call__(self, object_list):
+        if getattr(object_list, 'statement', None) is None:
+            return exact_count(object_list)
+        connection = object_list.session.connection()
+        estimator = planner_estimators.get(connection.dialect.name)
+        estimate = None
+        if estimator is not None:
+            compiled = object_list.statement.compile(
+                dialect=connection.dialect)
+            params = compiled.params
+            if compiled.positional:
+                params = [params[key] for key in compiled.positiontup]
+            estimate = estimator(connection, compiled, params)
+        if estimate is None or estimate < self.exact_below:
+            return exact_count(object_list)
+        return estimate
+
+#: Beaker namespace holding the current version of every table.
+TABLE_VERSION_NAMESPACE = 'rdreilib.pagination.versions'
+
+def table_versions(cache_manager, tables):
+    """Returns the current version tokens of the given table names."""
+    cache = cache_manager.get_cache(TABLE_VERSION_NAMESPACE)
+    return [cache.get(table, createfunc=lambda: uuid4().hex)
+            for table in tables]
+
+def bump_table_versions(cache_manager, tables):
+    """Invalidates all cached pages that read from any of ``tables``."""
+    cache = cache_manager.get_cache(TABLE_VERSION_NAMESPACE)
+    for table in tables:
+        cache.put(table, uuid4().hex)
+
+def track_table_versions(get_cache_manager, target=Session):
+    """Bumps the version of every table written to by a session once the
+    transaction is committed. ``get_cache_manager`` is called at that point
+    and returns the beaker cache manager to use, or None to skip. Tables
+    written in a savepoint count once the outermost transaction commits.
+    Bulk ``Query.update()``/``delete()`` and raw SQL are not noticed.
+
+    ``target`` is anything SQLAlchemy accepts for session events and
+    defaults to all sessions.
+    """
+    def after_flush(session, flush_context):
+        transaction = _outer_transaction(session.transaction)
+        tables = transaction.__dict__.setdefault('_written_tables', set())
+        for obj in list(session.new) + list(session.dirty) + \
+                   list(session.deleted):
+            tables.update(table.name for table in object_mapper(obj).tables)
+
+    def after_commit(session):
+        transaction = session.transaction
+        tables = transaction.__dict__.pop('_written_tables', None)
+        if not tables:
+            return
+        if transaction.nested:
+            # A released savepoint is only written by the outer commit.
+            parent = _outer_transaction(transaction._parent)
+            parent.__dict__.setdefault('_written_tables', set()) \
+                .update(tables)
+            return
+        cache_manager = get_cache_manager()
+        if cache_manager is not None:
+            bump_table_versions(cache_manager, tables)
+
+    # The tables of rolled back transactions and savepoints are dropped
+    # with the transaction.
+    event.listen(target, 'after_flush', after_flush)
+    event.listen(target, 'after_commit', after_commit)
+
+def _outer_transaction(transaction):
+    """Returns the savepoint or the transaction ``transaction`` belongs
+    to, skipping the subtransactions of flushes."""
+    while transaction._parent is not None and not transaction.nested:
+        transaction = transaction._parent
+    return transaction
+
+def _load_by_primary_keys(query, entity, pks):
+    """Returns the instances for ``pks`` in the same order. Instances in the
+    identity map are used as they are, the rest is loaded at once."""
+    mapper = class_mapper(entity)
+    session = query.session
+    found = {}
+    missing = []
+    for pk in pks:
+        obj = session.identity_map.get(
+            mapper.identity_key_from_primary_key(pk))
+        if obj is None:
+            missing.append(pk)
+        else:
+            found[tuple(pk)] = obj
+    if missing and len(mapper.primary_key) == 1:
+        column = mapper.primary_key[0]
+        for obj in session.query(entity).filter(
+                column.in_([pk[0] for pk in missing])):
+            found[tuple(mapper.primary_key_from_instance(obj))] = obj
+    elif missing:
+        for pk in missing:
+            obj = session.query(entity).get(pk)
+            if obj is not None:
+                found[tuple(pk)] = obj
+    # Rows deleted behind our back are simply left out.
+    return [found[tuple(pk)] for pk in pks if tuple(pk) in found]
+
+class PageCache(object):
+    """Caches pages of a query in beaker, keyed by the query fingerprint,
+    page number and size. Only the primary keys are stored, the objects are
+    taken from the identity map or loaded with one query by primary key.
+
+    Entries are invalidated by the versions of the tables the query reads
+    from, see `track_table_versions`, and expire after ``expire`` seconds.
+    Queries for anything but a single mapped class are not cached.
+
+    Example use::
+
+        paginator = Paginator(query, 20, page_cache=PageCache(req.cache))
+    """
+
+    def __init__(self, cache_manager, namespace='rdreilib.pagination.pages',
+                 expire=300):
+        self.cache_manager = cache_manager
+        self.namespace = namespace
+        self.expire = expire
+
+    def _get_cache(self):
+        return self.cache_manager.get_cache(self.namespace,
+                                            expire=self.expire)
+
+    def _get_entity(self, query):
+        if getattr(query, 'statement', None) is None or \
+           len(query.column_descriptions) != 1:
+            return None
+        entity = query.column_descriptions[0]['type']
+        try:
+            class_mapper(entity)
+        except UnmappedClassError:
+            return None
+        return entity
+
+    def make_key(self, paginator, number):
+        """Returns the cache key of a page, or None if it can't be cached."""
+        query = paginator.object_list
+        if self._get_entity(query) is None:
+            return None
+        tables = sorted(set(table.name for table in
+                            find_tables(query.statement)))
+        versions = table_versions(self.cache_manager, tables)
+        return '%s:%d:%d:%d:%d:%s' % (
+            query_fingerprint(query), number, paginator.per_page,
+            paginator.orphans, paginator.lookahead,
+            hashlib.sha1(' '.join(versions)).hexdigest())
+
+    def get_page(self, paginator, number, fetch):
+        """Returns the page from the cache or calls ``fetch(number)`` and
+        stores what it returns."""
+        try:
+            key = self.make_key(paginator, int(number))
+        except (TypeError, ValueError):
+            key = None
+        if key is None:
+            return fetch(number)
+
+        cache = self._get_cache()
+        query = paginator.object_list
+        entity = self._get_entity(query)
+        try:
+            pks, count, has_next = cache.get(key)
+        except KeyError:
+            page = fetch(number)
+            self._store(cache, key, entity, page)
+            return page
+
+        number = int(number)
+        if paginator.countless:
+            paginator._num_pages = number + int(has_next)
+        else:
+            paginator._count, paginator._num_pages = count, None
+        page = Page(_load_by_primary_keys(query, entity, pks), number,
+                    paginator)
+        page._has_next = has_next
+        return page
+
+    def warm(self, paginator, number):
+        """Fetches and stores a page unless it is cached already."""
+        key = self.make_key(paginator, number)
+        if key is None:
+            return
+        cache = self._get_cache()
+        if not cache.has_key(key):
+            page = paginator._page(number)
+            # Nobody else is going to look at the rows.
+            len(page.object_list)
+            self._store(cache, key, self._get_entity(paginator.object_list),
+                        page)
+
+    def _store(self, cache, key, entity, page):
+        mapper = class_mapper(entity)
+        def store(object_list):
+            cache.put(key, ([mapper.primary_key_from_instance(obj)
+                             for obj in object_list],
+                            page.paginator._count, page._has_next))
+        if isinstance(page.object_list, LazyPageList):
+            # Pages that are never shown are not worth caching.
+            page.object_list.on_load(store)
+        else:
+            store(page.object_list)
+
+class Prefetcher(object):
+    """Warms pages into their paginator's `PageCache` on a background
+    thread, outside of the request. At most ``maxsize`` pages wait to be
+    fetched; further requests are dropped, as are all requests while
+    ``enabled`` is False. Set that under load.
+    """
+
+    def __init__(self, maxsize=100):
+        self.queue = Queue(maxsize)
+        self.enabled = True
+        self._thread = None
+        self._lock = Lock()
+
+    def schedule(self, paginator, number):
+        """Queues ``number`` of ``paginator`` to be warmed. Returns False
+        if the page was dropped."""
+        if not self.enabled or paginator.page_cache is None or \
+           getattr(paginator.object_list, 'statement', None) is None:
+            return False
+        paginator = copy.copy(paginator)
+        paginator.prefetch = None
+        try:
+            self.queue.put_nowait((paginator, number))
+        except Full:
+            return False
+        self._ensure_worker()
+        return True
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.isAlive():
+                self._thread = Thread(target=self._work,
+                                      name='rdreilib.pagination.Prefetcher')
+                self._thread.setDaemon(True)
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            paginator, number = self.queue.get()
+            try:
+                if self.enabled:
+                    self.warm(paginator, number)
+            except InvalidPage:
+                pass
+            except Exception:
+                log.exception('Prefetching page %r failed', number)
+            finally:
+                self.queue.task_done()
+
+    def warm(self, paginator, number):
+        """Warms a page on a session of its own."""
+        def fetch(query):
+            paginator.object_list = query
+            paginator.page_cache.warm(paginator, number)
+        _in_own_session(fetch, paginator.object_list)
+
+#: Prefetcher used by paginators created with ``prefetch=True``.
+default_prefetcher = Prefetcher()
+
+#: Number of threads shared by all paginators for concurrent counts.
+WORKER_POOL_SIZE = 4
+
+_worker_pool = None
+_worker_pool_lock = Lock()
+
+def _get_worker_pool():
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = ThreadPool(WORKER_POOL_SIZE)
+    return _worker_pool
+
+def _in_own_session(func, object_list):
+    """Calls ``func`` with the query rebound to a new session, so it can be
+    run from another thread on a connection of its own. Note that the new
+    session does not see uncommitted changes of the original one."""
+    if getattr(object_list, 'statement', None) is None:
+        return func(object_list)
+    session = Session(bind=object_list.session.get_bind(
+        clause=object_list.statement))
+    try:
+        return func(object_list.with_session(session))
+    finally:
+        session.close()
+
 class Paginator(object):
-    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True):
+    """Splits ``object_list``, a sequence or SQLAlchemy query, into pages.
+
+    If ``concurrent_count`` is True, ``page()`` runs the count on a pooled
+    worker thread and connection while the rows are fetched, so both cost
+    about one round trip. The page query then includes the possible
+    orphans, which are dropped once the count is known. With ``reconcile``
+    the rows win where the two disagree, since both queries run in
+    separate transactions: a short page means there is nothing behind it.
+
+    A `PageCache` passed as ``page_cache`` serves repeated requests for the
+    same page of a query without touching the database.
+    """
+    #: True if pages are fetched without knowing the total count.
+    countless = False
+
+    def __init__(self, object_list, per_page, orphans=0,
+                 allow_empty_first_page=True, count_provider=None,
+                 concurrent_count=False, reconcile=True, page_cache=None):
         self.object_list = object_list
         self.per_page = per_page
         self.orphans = orphans
         self.allow_empty_first_page = allow_empty_first_page
+        self.count_provider = count_provider or exact_count
+        self.concurrent_count = concurrent_count
+        self.reconcile = reconcile
+        self.page_cache = page_cache
         self._num_pages = self._count = None
 
+    @property
+    def lookahead(self):
+        """True if pages are fetched one row ahead instead of relying on
+        the count."""
+        return self.countless or \
+                getattr(self.count_provider, 'approximate', False)
+
     def validate_number(self, number):
         "Validates the given 1-based page number."
         try:
@@ -36,7 +605,7 @@ class Paginator(object):
             raise PageNotAnInteger('That page number is not an integer')
         if number < 1:
             raise EmptyPage('That page number is less than 1')
-        if number > self.num_pages:
+        if number > self.num_pages and not self.lookahead:
             if number == 1 and self.allow_empty_first_page:
                 pass
             else:
@@ -45,23 +614,144 @@ class Paginator(object):
 
     def page(self, number):
         "Returns a Page object for the given 1-based page number."
+        if self.page_cache is not None:
+            return self.page_cache.get_page(self, number, self._page)
+        return self._page(number)
+
+    def _page(self, number):
+        if self.concurrent_count and self._count is None and \
+           not self.lookahead:
+            return self._concurrent_page(number)
         number = self.validate_number(number)
+        if self.lookahead:
+            return self._lookahead_page(number)
         bottom = (number - 1) * self.per_page
         top = bottom + self.per_page
         if top + self.orphans >= self.count:
             top = self.count
-        return Page(self.object_list[bottom:top], number, self)
+        return Page(LazyPageList(self.object_list, bottom, top), number, self)
+
+    def _concurrent_page(self, number):
+        try:
+            bottom = (int(number) - 1) * self.per_page
+        except ValueError:
+            raise PageNotAnInteger('That page number is not an integer')
+        count = _get_worker_pool().apply_async(
+            _in_own_session, (self.count_provider, self.object_list))
+        top = bottom + self.per_page + self.orphans
+        object_list = list(self.object_list[max(0, bottom):top])
+        self._count = count.get()
+        if self.reconcile and bottom >= 0 and (object_list or not bottom) and \
+           len(object_list) < top - bottom:
+            self._count = bottom + len(object_list)
+        number = self.validate_number(number)
+        if bottom + self.per_page + self.orphans < self._count:
+            del object_list[self.per_page:]
+        else:
+            del object_list[max(0, self._count - bottom):]
+        return Page(object_list, number, self)
+
+    def _lookahead_page(self, number):
+        """Fetches one row more than shown to tell whether there is a next
+        page. Approximate counts are corrected with what was found."""
+        bottom = (number - 1) * self.per_page
+        # Orphans are part of this page unless there is more behind them.
+        top = bottom + self.per_page + self.orphans
+        object_list = list(self.object_list[bottom:top + 1])
+        has_next = len(object_list) > top - bottom
+        if has_next:
+            del object_list[self.per_page:]
+        elif not object_list and (number > 1 or
+                                  not self.allow_empty_first_page):
+            if not self.countless:
+                self._count = min(self.count, bottom)
+                self._num_pages = None
+            raise EmptyPage('That page contains no results')
+
+        if self.countless:
+            self._num_pages = number + int(has_next)
+        else:
+            if has_next:
+                self._count = max(self.count, top + 1)
+            else:
+                self._count = bottom + len(object_list)
+            self._num_pages = None
+        page = Page(object_list, number, self)
+        page._has_next = has_next
+        return page
+
+    def _iter_chunks(self, order_by=None, descending=False):
+        if getattr(self.object_list, 'statement', None) is None:
+            bottom = 0
+            while True:
+                chunk = list(self.object_list[bottom:bottom + self.per_page])
+                if chunk:
+                    yield chunk
+                if len(chunk) < self.per_page:
+                    break
+                bottom += self.per_page
+        elif order_by:
+            order_by = tuple(order_by)
+            query = _order_query(self.object_list, order_by, descending)
+            chunk = query[:self.per_page]
+            while chunk:
+                yield chunk
+                if len(chunk) < self.per_page:
+                    break
+                chunk = query.filter(_keyset_criterion(order_by,
+                    _keyset_values(chunk[-1], order_by), descending)
+                )[:self.per_page]
+        else:
+            rows = iter(self.object_list.yield_per(self.per_page))
+            while True:
+                chunk = list(islice(rows, self.per_page))
+                if not chunk:
+                    break
+                yield chunk
+
+    def iter_pages(self, order_by=None, descending=False):
+        """Yields all pages in order, holding no more than two of them in
+        memory at a time and without counting.
+
+        Sequences are sliced. Queries are walked by seeking past the last
+        row of the previous page if ``order_by`` columns are given, see
+        `KeysetPaginator`, and are streamed with ``yield_per`` otherwise,
+        which does not work with eager loaded collections. Orphans are not
+        merged into the last page.
+
+        >>> [page.object_list for page in Paginator(range(1, 8), 3).iter_pages()]
+        [[1, 2, 3], [4, 5, 6], [7]]
+        """
+        number, chunks = 1, self._iter_chunks(order_by, descending)
+        chunk = next(chunks, None)
+        if chunk is None:
+            if self.allow_empty_first_page:
+                page = Page([], 1, self)
+                page._has_next = False
+                yield page
+            return
+        while chunk is not None:
+            following = next(chunks, None)
+            page = Page(chunk, number, self)
+            page._has_next = following is not None
+            yield page
+            number, chunk = number + 1, following
+
+    def iter_objects(self, order_by=None, descending=False):
+        """Yields all objects, fetched in chunks of ``per_page``. Takes the
+        same arguments as `iter_pages`.
+
+        >>> list(Paginator(range(1, 8), 3).iter_objects())
+        [1, 2, 3, 4, 5, 6, 7]
+        """
+        for chunk in self._iter_chunks(order_by, descending):
+            for obj in chunk:
+                yield obj
 
     def _get_count(self):
         "Returns the total number of objects, across all pages."
         if self._count is None:
-            try:
-                self._count = self.object_list.count()
-            except (AttributeError, TypeError):
-                # AttributeError if object_list has no count() method.
-                # TypeError if object_list.count() requires arguments
-                # (i.e. is of type list).
-                self._count = len(self.object_list)
+            self._count = self.count_provider(self.object_list)
         return self._count
     count = property(_get_count)
 
@@ -86,7 +776,75 @@ class Paginator(object):
 
 QuerySetPaginator = Paginator # For backwards-compatibility.
 
+class LazyPageList(object):
+    """The objects on a page. They are fetched on first access and kept
+    from then on, so pages that are only used for their navigation never
+    query any rows.
+
+    >>> page = Paginator(range(1, 1000), 10).page(2)
+    >>> page.object_list
+    <LazyPageList [10:20] (not loaded)>
+    >>> len(page.object_list), page.object_list[0]
+    (10, 11)
+    >>> page.object_list
+    [11, 12, 13, 14, 15, 16, 17, 18, 19, 20]
+    """
+
+    def __init__(self, object_list, bottom, top):
+        self._source = object_list
+        self._bottom = bottom
+        self._top = top
+        self._objects = None
+        self._callbacks = []
+
+    @property
+    def loaded(self):
+        return self._objects is not None
+
+    def on_load(self, callback):
+        """Calls ``callback`` with the list of objects once they are
+        fetched, or right away if they already are."""
+        if self.loaded:
+            callback(self._objects)
+        else:
+            self._callbacks.append(callback)
+
+    def _load(self):
+        if self._objects is None:
+            self._objects = list(self._source[self._bottom:self._top])
+            self._source = None
+            callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                callback(self._objects)
+        return self._objects
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __nonzero__(self):
+        return bool(self._load())
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __contains__(self, obj):
+        return obj in self._load()
+
+    def __repr__(self):
+        if not self.loaded:
+            return '<LazyPageList [%d:%d] (not loaded)>' % (self._bottom,
+                                                           self._top)
+        return repr(self._objects)
+
 class Page(object):
+    #: Set by paginators that look ahead instead of counting.
+    _has_next = None
+    #: Snapshot bound of pages fetched with a page token.
+    _snapshot = None
+
     def __init__(self, object_list, number, paginator):
         self.object_list = object_list
         self.number = number
@@ -96,6 +854,8 @@ class Page(object):
         return '<Page %s of %s>' % (self.number, self.paginator.num_pages)
 
     def has_next(self):
+        if self._has_next is not None:
+            return self._has_next
         return self.number < self.paginator.num_pages
 
     def has_previous(self):
@@ -105,6 +865,11 @@ class Page(object):
         return self.has_previous() or self.has_next()
 
     def next_page_number(self):
+        next_page_token = getattr(self.paginator, 'next_page_token', None)
+        if next_page_token is not None:
+            token = next_page_token(self)
+            if token is not None:
+                return token
         return self.number + 1
 
     def previous_page_number(self):
@@ -116,7 +881,10 @@ class Page(object):
         relative to total objects in the paginator.
         """
         # Special case, return zero if no items.
-        if self.paginator.count == 0:
+        if self.paginator.countless:
+            if not self.object_list:
+                return 0
+        elif self.paginator.count == 0:
             return 0
         return (self.paginator.per_page * (self.number - 1)) + 1
 
@@ -125,6 +893,9 @@ class Page(object):
         Returns the 1-based index of the last object on this page,
         relative to total objects found (hits).
         """
+        if self.paginator.countless:
+            return (self.paginator.per_page * (self.number - 1)) + \
+                    len(self.object_list)
         # Special case for the last page because there can be orphans.
         if self.number == self.paginator.num_pages:
             return self.paginator.count
@@ -140,6 +911,23 @@ class ExPaginator(Paginator):
     possibly see links to invalid pages at some point which we wouldn't
     want to fail as 404s.
 
+    If ``countless`` is True, no count is issued at all. Instead, one row
+    more than displayed is fetched to tell whether there is a next page and
+    ``num_pages`` only covers the pages known so far. The exact total is
+    still counted when a page past the end is requested with ``softlimit``,
+    which is also true for approximate count providers.
+
+    With a ``page_cache``, ``prefetch`` can be set to a `Prefetcher`, or
+    True for the `default_prefetcher`, to warm the following page in the
+    background after every page served.
+
+    Given keyset columns as ``order_by`` and a ``secret``, pages of a query
+    link to the following page with a signed token, see `make_page_token`,
+    which ``page()`` accepts in place of a number. The token remembers the
+    last row shown and the highest ``snapshot_column`` value, by default
+    the last of ``order_by``, when paging started. Rows inserted in the
+    meantime don't shift later pages, and no offset is used for them.
+
     >>> items = range(1, 1000)
     >>> paginator = ExPaginator(items, 10)
     >>> paginator.page(1000)
@@ -152,7 +940,38 @@ class ExPaginator(Paginator):
     >>> paginator.page("str")
     Traceback (most recent call last):
     PageNotAnInteger: That page number is not an integer
+
+    # countless mode looks one row ahead
+    >>> paginator = ExPaginator(items, 10, countless=True)
+    >>> page = paginator.page(50)
+    >>> page.has_next(), page.end_index(), paginator.num_pages
+    (True, 500, 51)
+    >>> page = paginator.page(100)
+    >>> page.has_next(), page.end_index()
+    (False, 999)
+    >>> paginator.page(101)
+    Traceback (most recent call last):
+    EmptyPage: That page contains no results
+    >>> paginator.page(1000, softlimit=True)
+    <Page 100 of 100>
     """
+    def __init__(self, *args, **kwargs):
+        self.countless = kwargs.pop('countless', False)
+        self.prefetch = kwargs.pop('prefetch', None)
+        if self.prefetch is True:
+            self.prefetch = default_prefetcher
+        self.order_by = tuple(kwargs.pop('order_by', ()))
+        self.descending = kwargs.pop('descending', False)
+        self.snapshot_column = kwargs.pop('snapshot_column', None)
+        if self.snapshot_column is None and self.order_by:
+            self.snapshot_column = self.order_by[-1]
+        self.secret = kwargs.pop('secret', None)
+        super(ExPaginator, self).__init__(*args, **kwargs)
+        if self.order_by and \
+           getattr(self.object_list, 'statement', None) is not None:
+            self.object_list = _order_query(self.object_list, self.order_by,
+                                            self.descending)
+
     def _ensure_int(self, num, e):
         # see Django #7307
         try:
@@ -161,14 +980,58 @@ class ExPaginator(Paginator):
             raise e
 
     def page(self, number, softlimit=False):
+        if self.secret is not None and _is_page_token(number):
+            return self._token_page(number, softlimit)
         try:
-            return super(ExPaginator, self).page(number)
+            page = super(ExPaginator, self).page(number)
         except InvalidPage, e:
             number = self._ensure_int(number, e)
+            if softlimit and self.lookahead and number > 1:
+                # Only the exact total can tell where the last page is.
+                self._count = exact_count(self.object_list)
+                self._num_pages = None
             if number > self.num_pages and softlimit:
                 return self.page(self.num_pages, softlimit=False)
             else:
                 raise e
+        if self.prefetch is not None and page.has_next():
+            self.prefetch.schedule(self, page.number + 1)
+        return page
+
+    def _token_page(self, token, softlimit):
+        number, position, snapshot = parse_page_token(token, self.secret)
+        if len(position) != len(self.order_by):
+            raise InvalidCursor('Page token does not match the ordering')
+        query = self.object_list.filter(and_(
+            self.snapshot_column <= snapshot,
+            _keyset_criterion(self.order_by, position, self.descending)))
+        object_list = list(query[:self.per_page + 1])
+        has_next = len(object_list) > self.per_page
+        del object_list[self.per_page:]
+        if not object_list:
+            if softlimit:
+                return ExPaginator.page(self, number, softlimit)
+            raise EmptyPage('That page contains no results')
+        if self.countless:
+            self._num_pages = number + int(has_next)
+        page = Page(object_list, number, self)
+        page._has_next = has_next
+        page._snapshot = snapshot
+        return page
+
+    def next_page_token(self, page):
+        """Returns the token of the page following ``page``, or None if
+        tokens are not enabled."""
+        if not self.order_by or self.secret is None or \
+           getattr(self.object_list, 'statement', None) is None or \
+           not page.has_next() or not page.object_list:
+            return None
+        snapshot = page._snapshot
+        if snapshot is None:
+            snapshot = self.object_list.order_by(None).value(
+                func.max(self.snapshot_column))
+        return make_page_token(page.number + 1, _keyset_values(
+            page.object_list[-1], self.order_by), snapshot, self.secret)
 
 class DiggPaginator(ExPaginator):
     """
@@ -216,7 +1079,9 @@ class DiggPaginator(ExPaginator):
     When ``align_left`` is set to ``True``, the paginator operates in a
     special mode that always skips the right tail, e.g. does not display the
     end block unless necessary. This is useful for situations in which the
-    exact number of items/pages is not actually known.
+    exact number of items/pages is not actually known. Combined with
+    ``countless=True`` the ranges are computed from the pages seen so far
+    and no count query is issued.
 
     # odd body length
     >>> print DiggPaginator(range(1,1000), 10, body=5).page(1)
@@ -282,6 +1147,31 @@ class DiggPaginator(ExPaginator):
     >>> print DiggPaginator(range(1,1000), 10, body=5, align_left=True).page(100)
     1 2 ... 96 97 98 99 100
 
+    # left align mode without counting
+    >>> print DiggPaginator(range(1,1000), 10, body=5, align_left=True, countless=True).page(1)
+    1 2
+    >>> print DiggPaginator(range(1,1000), 10, body=5, align_left=True, countless=True).page(50)
+    1 2 ... 47 48 49 50 51
+    >>> print DiggPaginator(range(1,1000), 10, body=5, align_left=True, countless=True).page(100)
+    1 2 ... 96 97 98 99 100
+
+    # approximate counts are corrected by the pages actually fetched
+    >>> class Guess(CountProvider):
+    ...     approximate = True
+    ...     def __call__(self, object_list):
+    ...         return 500
+    >>> print DiggPaginator(range(1,1000), 10, body=5, count_provider=Guess()).page(50)
+    1 2 ... 47 48 49 50 51
+    >>> print DiggPaginator(range(1,1000), 10, body=5, count_provider=Guess()).page(80)
+    1 2 ... 77 78 79 80 81
+    >>> print DiggPaginator(range(1,1000), 10, body=5, count_provider=Guess()).page(100)
+    1 2 ... 96 97 98 99 100
+    >>> print DiggPaginator(range(1,100), 10, body=5, count_provider=Guess()).page(20, softlimit=True)
+    1 2 3 4 5 6 7 8 9 10
+    >>> DiggPaginator(range(1,1000), 10, countless=True)
+    Traceback (most recent call last):
+    ValueError: countless mode requires align_left
+
     # padding: default value
     >>> DiggPaginator(range(1,1000), 10, body=10).padding
     4
@@ -308,6 +1198,9 @@ class DiggPaginator(ExPaginator):
         if self.padding > max_padding:
             raise ValueError('padding too large for body (max %d)'%max_padding)
         super(DiggPaginator, self).__init__(*args, **kwargs)
+        if self.countless and not self.align_left:
+            # The trailing range would point at made up pages.
+            raise ValueError('countless mode requires align_left')
 
     def page(self, number, *args, **kwargs):
         """Return a standard ``Page`` instance with custom, digg-specific
@@ -319,7 +1212,7 @@ class DiggPaginator(ExPaginator):
             number = self.num_pages
 
         page = super(DiggPaginator, self).page(number, *args, **kwargs)
-        number = int(number) # we know this will work
+        number = page.number
 
         # easier access
         num_pages, body, tail, padding, margin = \
@@ -396,6 +1289,113 @@ class DiggPage(Page):
                             " ".join(map(str, self.main_range)),
                             " ".join(map(str, self.trailing_range))]))
 
+class KeysetPaginator(Paginator):
+    """Paginates a SQLAlchemy query by seeking to the last seen row
+    instead of using ``OFFSET``. Every page is a range query on the
+    ordering columns, so deep pages cost the same as the first one as long
+    as there is an index on them.
+
+    ``order_by`` is a sequence of mapped attributes that together uniquely
+    identify a row, usually the sort column followed by the primary key::
+
+        paginator = KeysetPaginator(Entry.query, 20,
+                                    (Entry.pub_date, Entry.id))
+        page = paginator.page(req.args.get('page'))
+
+    Pages are not addressed by numbers but by opaque cursors, which are
+    returned by ``next_page_number()`` and ``previous_page_number()`` so
+    existing templates linking to ``?page=...`` keep working. ``None``
+    requests the first page. Orphans are not supported.
+    """
+    def __init__(self, object_list, per_page, order_by, descending=False,
+                 allow_empty_first_page=True):
+        super(KeysetPaginator, self).__init__(
+            object_list, per_page, allow_empty_first_page=allow_empty_first_page)
+        self.order_by = tuple(order_by)
+        self.descending = descending
+
+    def iter_pages(self, order_by=None, descending=None):
+        if descending is None:
+            descending = self.descending
+        return super(KeysetPaginator, self).iter_pages(
+            order_by or self.order_by, descending)
+
+    def iter_objects(self, order_by=None, descending=None):
+        if descending is None:
+            descending = self.descending
+        return super(KeysetPaginator, self).iter_objects(
+            order_by or self.order_by, descending)
+
+    def _ordered(self, reverse=False):
+        return _order_query(self.object_list, self.order_by,
+                            self.descending != reverse)
+
+    def page(self, cursor=None):
+        "Returns a KeysetPage for the given cursor."
+        if cursor is not None and not isinstance(cursor, basestring):
+            raise InvalidCursor('Cursor must be a string, not %r' % (cursor,))
+        before = False
+        query = self._ordered()
+        if cursor:
+            before = cursor.startswith('~')
+            values = decode_cursor(before and cursor[1:] or cursor)
+            if len(values) != len(self.order_by):
+                raise InvalidCursor('Cursor does not match the ordering')
+            query = self._ordered(before).filter(_keyset_criterion(
+                self.order_by, values, self.descending != before))
+
+        # One extra row tells us whether there is another page.
+        object_list = list(query[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        del object_list[self.per_page:]
+        if before:
+            object_list.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = bool(cursor), has_more
+
+        if not object_list and (cursor or not self.allow_empty_first_page):
+            raise EmptyPage('That page contains no results')
+        return KeysetPage(object_list, cursor, self, has_previous, has_next)
+
+class KeysetPage(Page):
+    def __init__(self, object_list, cursor, paginator, has_previous,
+                 has_next):
+        super(KeysetPage, self).__init__(object_list, cursor, paginator)
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<KeysetPage at %s>' % (self.number or 'start')
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_page_number(self):
+        "Returns the cursor of the following page."
+        if not self.object_list:
+            return None
+        return encode_cursor(_keyset_values(self.object_list[-1],
+                                            self.paginator.order_by))
+
+    def previous_page_number(self):
+        "Returns the cursor of the preceding page."
+        if not self.object_list:
+            return None
+        return '~' + encode_cursor(_keyset_values(self.object_list[0],
+                                                  self.paginator.order_by))
+
+    def start_index(self):
+        """
+        Keyset pages have no absolute position, so this returns None.
+        Templates can test it to hide "x to y of z" figures.
+        """
+        return None
+
+    def end_index(self):
+        "Returns None like start_index."
+        return None
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
\ No newline at end of file
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+    rdreilib.serializers
+    ~~~~~~~~~~~~~~~~~~~~
+
+    The registry of output formats shared by :mod:`rdreilib.api` and
+    :mod:`rdreilib.jsonlib`, and the JSON backend both of them use.
+
+    A format is a name, a function dumping a data structure into a string,
+    the mimetype of the result and, optionally, the mimetypes it is
+    selected for by content negotiation and a function yielding the output
+    in chunks for streamed responses::
+
+        register_serializer('yaml', yaml.safe_dump, 'application/x-yaml',
+                            mimetypes=('application/x-yaml', 'text/yaml'))
+
+    JSON is encoded with shared encoder instances and compact separators.
+    The C-accelerated encoder of simplejson is used if it is compiled, see
+    :func:`set_json_backend`.
+
+    :copyright: 2026 by the rdreilib team, see doc/AUTHORS for more details.
+    :license: BSD, see doc/LICENSE for more details.
+"""
+from glashammer.utils.lazystring import is_lazy_string
+
+from .remoting import RemoteObject
+
+
+#: name -> (dump function, mimetype)
+serializers = {}
+
+#: name -> function yielding byte chunks, for the formats that stream
+stream_serializers = {}
+
+#: accepted mimetype -> name, used for content negotiation
+serializer_mimetypes = {}
+
+#: names of the formats that export remote objects themselves
+raw_serializers = set()
+
+_change_callbacks = []
+
+
+def on_serializers_changed(callback):
+    """Registers ``callback`` to be called without arguments whenever a
+    format is registered or removed."""
+    _change_callbacks.append(callback)
+
+
+def _changed():
+    for callback in _change_callbacks:
+        callback()
+
+
+def register_serializer(name, dump, mimetype, mimetypes=None, stream=None,
+                        raw=False):
+    """Registers the format ``name``, replacing a format of the same name.
+    ``mimetypes`` defaults to ``mimetype`` alone. If ``raw`` is set, the API
+    passes results to ``dump`` without exporting them first."""
+    unregister_serializer(name)
+    serializers[name] = (dump, mimetype)
+    if stream is not None:
+        stream_serializers[name] = stream
+    if raw:
+        raw_serializers.add(name)
+    for accepted in mimetypes or (mimetype,):
+        serializer_mimetypes[accepted] = name
+    _changed()
+
+
+def unregister_serializer(name):
+    """Removes the format ``name`` if it is registered."""
+    serializers.pop(name, None)
+    stream_serializers.pop(name, None)
+    raw_serializers.discard(name)
+    for accepted, format in serializer_mimetypes.items():
+        if format == name:
+            del serializer_mimetypes[accepted]
+    _changed()
+
+
+def lookup_serializer(name):
+    """Returns ``(dump, mimetype)`` for the format ``name``. Raises a
+    `KeyError` for unknown formats."""
+    return serializers[name]
+
+
+def json_default(o):
+    """The `default` hook of the shared encoders: lazy strings, remote
+    objects and objects with a `__json__` method are encoded as well."""
+    if is_lazy_string(o):
+        return unicode(o)
+    if isinstance(o, RemoteObject):
+        return o.remote_export()
+    if hasattr(o, '__json__'):
+        return o.__json__()
+    raise TypeError('%r is not JSON serializable' % (o,))
+
+
+def _simplejson_backend(accelerated):
+    import simplejson
+    from simplejson import encoder
+    if accelerated and encoder.c_make_encoder is None:
+        raise ImportError('simplejson is not compiled with speedups')
+    return simplejson.JSONEncoder
+
+
+#: The JSON backends in order of preference. Each factory returns an
+#: encoder class or raises an `ImportError` if it is not available. The
+#: last one is simplejson as it is installed, without speedups it falls
+#: back to pure Python. Only simplejson encoders are used, so the output
+#: does not depend on the speedups, e.g. for decimals and namedtuples.
+json_backends = [
+    ('simplejson', lambda: _simplejson_backend(True)),
+    ('pure', lambda: _simplejson_backend(False)),
+]
+
+_json_backend = None
+_json_encoder = None
+
+
+def set_json_backend(name=None):
+    """Selects the JSON backend ``name`` or, by default, the first one of
+    :data:`json_backends` that can be imported. Raises a `ValueError` if
+    the backend is unknown or not available."""
+    global _json_backend, _json_encoder
+    for backend, factory in json_backends:
+        if name is not None and backend != name:
+            continue
+        try:
+            encoder_class = factory()
+        except ImportError:
+            if name is not None:
+                raise ValueError('JSON backend %r is not available' % name)
+            continue
+        _json_encoder = encoder_class(separators=(',', ':'),
+                                      default=json_default)
+        _json_backend = backend
+        return backend
+    raise ValueError('Unknown JSON backend %r' % name)
+
+
+def get_json_backend():
+    """Returns the name of the selected JSON backend."""
+    return _json_backend
+
+
+def dump_json(obj):
+    """Dumps ``obj`` into compact JSON with the selected backend."""
+    return _json_encoder.encode(obj)
+
+
+set_json_backend()
+register_serializer('json', dump_json, 'application/json')
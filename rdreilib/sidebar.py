@@ -23,7 +23,28 @@ RE_COMPLEX_MODULECALL_OUTER = re.compile("(?P<name>[A-Za-z0-9_]+)\((?P<inner>[^)
 class PermissionError(Exception):
     pass
 
+class SidebarModuleMeta(type):
+    """Registers every sidebar module class that sets its own ``name`` in
+    the ``_modules`` dict of :class:`SidebarModule`."""
+
+    def __init__(cls, classname, bases, dict_):
+        type.__init__(cls, classname, bases, dict_)
+        name = dict_.get('name')
+        if name is None:
+            return
+        registered = cls._modules.get(name)
+        if registered is not None:
+            raise TypeError("Sidebar module name %r of %s.%s is already used "
+                            "by %s.%s" % (name, cls.__module__, classname,
+                                          registered.__module__,
+                                          registered.__name__))
+        cls._modules[name] = cls
+
 class SidebarModule(object):
+    __metaclass__ = SidebarModuleMeta
+    #: Maps the names of all modules to their classes
+    _modules = dict()
+
     # Base shortcut for all identifiers build by _set_defaults
     _modulename = None
     name = None
@@ -139,12 +160,9 @@ class SidebarModule(object):
     
     @classmethod
     def get_class(cls, name):
-        sm_class = None
-        for mod in cls.__subclasses__():
-            if mod.name == name:
-                sm_class = mod
-                break
-        if not sm_class:
+        """Returns the module class ``name`` derived from this class."""
+        sm_class = cls._modules.get(name)
+        if sm_class is None or not issubclass(sm_class, cls):
             raise LookupError("Unsupported module %r requested" % name)
         return sm_class
         
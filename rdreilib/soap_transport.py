@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+ rdreilib.soap_transport
+ ~~~~~~~~~~~~~~~~~~~~~~~
+ A suds transport keeping HTTP connections alive. The default transport
+ of suds opens a new connection through urllib2 for every SOAP call.
+
+ Connections are pooled per endpoint, the pool is shared by all clones of
+ a client, so a transport can be used from several threads at once.
+ Cookies and proxies are not supported.
+
+ :copyright: 2026 by the rdreilib team, see doc/AUTHORS for more details.
+ :license: BSD, see doc/LICENSE for more details.
+"""
+import socket
+import httplib
+from urllib2 import URLError
+from urlparse import urlsplit
+from threading import Lock, local
+from Queue import Queue, Empty, Full
+from StringIO import StringIO
+
+from suds.transport import Reply, TransportError
+from suds.transport.http import HttpTransport
+
+import logging
+
+log = logging.getLogger('rdreilib.soap_transport')
+
+_call_state = local()
+
+
+def get_call_timeout():
+    """Returns the timeout set by :func:`set_call_timeout`, if any."""
+    return getattr(_call_state, 'timeout', None)
+
+
+def set_call_timeout(timeout):
+    """Sets the timeout in seconds of the SOAP calls of the current thread,
+    None restores the timeout of the transport. Returns the previous
+    value."""
+    previous = get_call_timeout()
+    _call_state.timeout = timeout
+    return previous
+
+
+def _nothing_received(error):
+    """Returns True if ``error`` means the connection was closed before
+    any byte of the response arrived."""
+    # httplib reports this as a bad empty status line, the message differs
+    # between Python releases.
+    return isinstance(error, httplib.BadStatusLine) and \
+        (error.line == repr('') or error.line.startswith('No status line'))
+
+
+class KeepAliveTransport(HttpTransport):
+    """Sends SOAP requests over pooled keep-alive connections, at most
+    ``pool_size`` idle connections are kept per endpoint. WSDL files are
+    still read by the urllib2 transport of suds."""
+
+    def __init__(self, pool_size=4, **kwargs):
+        HttpTransport.__init__(self, **kwargs)
+        self.pool_size = pool_size
+        self._pools = {}
+        self._lock = Lock()
+
+    def _get_pool(self, key):
+        pool = self._pools.get(key)
+        if pool is None:
+            self._lock.acquire()
+            try:
+                pool = self._pools.setdefault(key, Queue(self.pool_size))
+            finally:
+                self._lock.release()
+        return pool
+
+    def _connect(self, scheme, netloc, timeout):
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=timeout)
+        return httplib.HTTPConnection(netloc, timeout=timeout)
+
+    def _send_request(self, conn, path, request, timeout):
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        conn.request('POST', path, request.message, request.headers)
+
+    def _read_response(self, conn):
+        response = conn.getresponse()
+        return response, response.read()
+
+    def send(self, request):
+        scheme, netloc, path, query, fragment = urlsplit(request.url)
+        if query:
+            path = '%s?%s' % (path, query)
+        timeout = get_call_timeout() or self.options.timeout
+        pool = self._get_pool((scheme, netloc))
+        try:
+            conn = pool.get_nowait()
+            reused = True
+        except Empty:
+            conn = self._connect(scheme, netloc, timeout)
+            reused = False
+
+        log.debug('sending:\n%s', request)
+        try:
+            sent = False
+            try:
+                self._send_request(conn, path, request, timeout)
+                sent = True
+                response, body = self._read_response(conn)
+            except (socket.error, httplib.HTTPException), e:
+                # Only retry if the server closed the idle connection before
+                # it could have run the call, SOAP calls need not be
+                # idempotent.
+                if not reused or isinstance(e, socket.timeout) or \
+                   (sent and not _nothing_received(e)):
+                    raise
+                conn.close()
+                conn = self._connect(scheme, netloc, timeout)
+                self._send_request(conn, path, request, timeout)
+                response, body = self._read_response(conn)
+        except (socket.error, httplib.HTTPException), e:
+            conn.close()
+            raise URLError(e)
+
+        if response.will_close:
+            conn.close()
+        else:
+            try:
+                pool.put_nowait(conn)
+            except Full:
+                conn.close()
+
+        if response.status in (202, 204):
+            return None
+        if response.status >= 300:
+            raise TransportError(response.reason, response.status,
+                                 StringIO(body))
+        result = Reply(response.status, dict(response.getheaders()), body)
+        log.debug('received:\n%s', result)
+        return result
+
+    def __deepcopy__(self, memo={}):
+        # Clones of a client share the connections.
+        clone = HttpTransport.__deepcopy__(self, memo)
+        clone.pool_size = self.pool_size
+        clone._pools = self._pools
+        clone._lock = self._lock
+        return clone
+
+
+__test__ = {'transport': r"""
+A stub server answers the requests of each connection it accepts with the
+next replies of its script, None closes the connection after reading the
+request.
+
+>>> import socket, threading
+>>> from suds.transport import Request
+>>> received = []
+>>> def serve(listener, script):
+...     for index, replies in enumerate(script):
+...         conn = listener.accept()[0]
+...         for reply in replies:
+...             data = conn.recv(65536)
+...             while '\r\n\r\n' not in data:
+...                 data += conn.recv(65536)
+...             received.append((index, data.split('\r\n\r\n', 1)[1]))
+...             if reply is None:
+...                 break
+...             conn.sendall(reply)
+...         conn.close()
+>>> def start(script):
+...     listener = socket.socket()
+...     listener.bind(('127.0.0.1', 0))
+...     listener.listen(1)
+...     thread = threading.Thread(target=serve, args=(listener, script))
+...     thread.daemon = True
+...     thread.start()
+...     return 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+>>> OK = 'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+>>> transport = KeepAliveTransport()
+
+Calls reuse the connection:
+
+>>> url = start([[OK, OK]])
+>>> [transport.send(Request(url, 'call %d' % i)).message for i in range(2)]
+['ok', 'ok']
+>>> received
+[(0, 'call 0'), (0, 'call 1')]
+
+If the server closed the idle connection, the call is sent again on a new
+one:
+
+>>> del received[:]
+>>> url = start([[OK, None], [OK]])
+>>> transport.send(Request(url, 'a')).message
+'ok'
+>>> transport.send(Request(url, 'b')).message
+'ok'
+>>> received
+[(0, 'a'), (0, 'b'), (1, 'b')]
+
+But not once the server started to answer, it may have run the call:
+
+>>> del received[:]
+>>> url = start([[OK, 'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nok']])
+>>> transport.send(Request(url, 'a')).message
+'ok'
+>>> transport.send(Request(url, 'b'))
+Traceback (most recent call last):
+URLError: <urlopen error IncompleteRead(2 bytes read, 8 more expected)>
+>>> received
+[(0, 'a'), (0, 'b')]
+"""}
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
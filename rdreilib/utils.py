@@ -9,4 +9,39 @@ Various, useful utilities.
 :license: BSD, see doc/LICENSE for more details.
 """
 
-# There's nothing useful, currently. (;
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """A dict-like cache holding at most ``maxsize`` items. Adding to a
+    full cache drops the least recently used item."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """Returns the item of ``key`` and marks it as recently used."""
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)